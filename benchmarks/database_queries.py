@@ -0,0 +1,235 @@
+"""Бенчмарк функций database.py на синтетических базах разного размера.
+
+Для каждого размера (benchmarks.seed.SCALES) база заполняется один раз и
+переиспользуется, а замеры идут на её копии, поэтому функции записи не
+влияют на следующие запуски. Результат - JSON, который можно сохранить и
+сравнить с прошлым запуском.
+
+Функции кэшированных запросов замеряются дважды: без кэша (inspect.unwrap
+снимает и кэш, и обёртку метрик) и с кэшем. Служебные функции запуска
+(init_db, init_pool и т.п.) и внутренние части других функций
+(load_draw_data, save_draw, insert_messages) отдельно не замеряются.
+
+Запуск из корня проекта:
+    python -m benchmarks.database_queries [--scales 1k 100k 1m] [--repeat 1.0]
+        [--output results.json] [--compare baseline.json --threshold 2.0]
+"""
+import argparse
+import asyncio
+import contextlib
+import inspect
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import database as db
+from benchmarks.seed import OUTBOX_MESSAGES, SCALES, layout, seed_database
+from handler.box_management_handler import format_draw_message
+
+NOW = '2030-01-01 00:00:00'
+
+
+async def _consume_export(id_box: int):
+    async for _ in db.iter_participants_export(id_box):
+        pass
+
+
+async def _consume_users():
+    async for _ in db.iter_known_users():
+        pass
+
+
+def build_cases(info: dict):
+    """Замеры: (название, число повторов, функция от номера повтора).
+    Сначала идут функции чтения, затем функции записи, чтобы запись не меняла
+    данные, на которых замеряется чтение."""
+    users = info['users']
+    big, small = info['big_box_id'], info['small_box_id']
+    last_box = info['last_box_id']
+    member = info['box_size'] + 1           # участник второй маленькой коробки
+    member_box = small + 1
+    power = info['power_user']
+    new_user = users + 1_000_000            # id новых пользователей не пересекаются с засеянными
+    created_boxes = []
+    added = []
+
+    def small_box(i):
+        return small + i % info['small_boxes']
+
+    async def add_box(i):
+        created_boxes.append(await db.add_box(power, f'Новая коробка {i}', None, 'Описание'))
+
+    async def delete_box(i):
+        await db.delete_box(created_boxes.pop())
+
+    async def add_participant(i):
+        added.append((new_user + i, small_box(i)))
+        await db.add_participant(new_user + i, 'Новый участник', 'Адрес', small_box(i), 'Пожелание')
+
+    async def remove_participant(i):
+        user_id, id_box = added.pop()
+        await db.remove_participant(user_id, id_box)
+
+    return [
+        # Чтение
+        ('get_user_info', 200, lambda i: db.get_user_info(1 + i % users)),
+        ('get_box_info', 200, lambda i: inspect.unwrap(db.get_box_info)(small_box(i))),
+        ('get_box_info (кэш)', 200, lambda i: db.get_box_info(small)),
+        ('is_box_owner', 200, lambda i: inspect.unwrap(db.is_box_owner)(power, small_box(i))),
+        ('is_box_owner (кэш)', 200, lambda i: db.is_box_owner(power, small)),
+        ('get_participant_info', 200, lambda i: inspect.unwrap(db.get_participant_info)(member, member_box)),
+        ('get_participant_info (кэш)', 200, lambda i: db.get_participant_info(member, member_box)),
+        ('is_participant', 200, lambda i: db.is_participant(member, member_box)),
+        ('get_box_participants (20)', 100, lambda i: db.get_box_participants(small_box(i))),
+        ('get_box_participants (большая)', 5, lambda i: db.get_box_participants(big)),
+        ('get_box_participants_page', 100, lambda i: db.get_box_participants_page(big, 31, after_id=i * 30)),
+        ('count_box_participants (большая)', 50, lambda i: db.count_box_participants(big)),
+        ('iter_participants_export (большая)', 3, lambda i: _consume_export(big)),
+        ('iter_known_users', 3, lambda i: _consume_users()),
+        ('get_participating_boxes', 100, lambda i: db.get_participating_boxes(1 + i % users, limit=9)),
+        ('get_created_boxes', 100, lambda i: db.get_created_boxes(power, limit=9)),
+        ('find_photo_copy', 200, lambda i: db.find_photo_copy(f'photo{small_box(i)}')),
+        ('count_photo_references', 200, lambda i: db.count_photo_references(f'photo_box/{i}.jpg')),
+        ('get_pending_messages', 50, lambda i: db.get_pending_messages(100)),
+        ('get_batch_progress', 50, lambda i: db.get_batch_progress(1)),
+        ('load_persistent_user_data', 3, lambda i: db.load_persistent_user_data('2000-01-01 00:00:00')),
+        ('load_persistent_conversations', 20, lambda i: db.load_persistent_conversations('join_box', NOW)),
+        # Жеребьевка
+        ('create_santa_pairs (20)', 50, lambda i: db.create_santa_pairs(small_box(i), seed=i)),
+        ('create_santa_pairs (большая)', 3, lambda i: db.create_santa_pairs(big, seed=i)),
+        ('create_santa_pairs_batch (100 коробок)', 3, lambda i: db.create_santa_pairs_batch(
+            [small_box(i * 100 + k) for k in range(100)], format_draw_message, seed=i
+        )),
+        # Запись
+        ('add_user', 200, lambda i: db.add_user(new_user + i, f'new{i}', NOW)),
+        ('add_box', 100, add_box),
+        ('delete_box', 100, delete_box),
+        ('add_participant', 100, add_participant),
+        ('update_participant_info', 100, lambda i: db.update_participant_info(
+            member, member_box, 'user_wish', f'Пожелание {i}'
+        )),
+        ('remove_participant', 100, remove_participant),
+        ('add_draw_exclusion', 100, lambda i: db.add_draw_exclusion(big, 1 + i, 2 + i)),
+        ('remove_draw_exclusion', 100, lambda i: db.remove_draw_exclusion(big, 1 + i, 2 + i)),
+        ('set_household', 100, lambda i: db.set_household(big, 1 + i, f'new{i}')),
+        ('set_previous_box', 100, lambda i: db.set_previous_box(small_box(i), last_box)),
+        ('set_box_photo_id', 100, lambda i: db.set_box_photo_id(small_box(i), f'file{i}', f'unique{i}')),
+        ('queue_messages (100)', 20, lambda i: db.queue_messages([(power, 'Текст')] * 100, title='bench')),
+        ('mark_messages (100)', 20, lambda i: db.mark_messages(
+            [(i * 100 + k + 1, True) for k in range(100) if i * 100 + k < OUTBOX_MESSAGES]
+        )),
+        ('set_batch_report_message', 100, lambda i: db.set_batch_report_message(1, i)),
+        ('purge_outbox', 3, lambda i: db.purge_outbox('2029-01-01 00:00:00')),
+        ('save_persistent_data (100)', 20, lambda i: db.save_persistent_data(
+            [(new_user + i * 100 + k, '{}') for k in range(100)],
+            [('join_box', f'[{k}, {k}]', '0') for k in range(100)]
+        )),
+        ('evict_persistent_data', 3, lambda i: db.evict_persistent_data('2029-01-01 00:00:00')),
+    ]
+
+
+async def measure(call, repeat: int) -> dict:
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        await call(i)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'best_ms': round(timings[0], 4),
+        'median_ms': round(statistics.median(timings), 4),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        'mean_ms': round(statistics.fmean(timings), 4),
+    }
+
+
+async def run_scale(scale: str, args) -> list:
+    seeded = seed_database(scale, args.db_dir)
+    path = os.path.join(args.db_dir, f'bench_{scale}.run.db')
+    shutil.copyfile(seeded, path)
+    print(f"[{scale}] база {path}", file=sys.stderr)
+
+    await db.close_pool()
+    await db.init_pool(path)
+    results = []
+    try:
+        for name, repeat, call in build_cases(layout(scale)):
+            result = await measure(call, max(1, int(repeat * args.repeat)))
+            results.append({'scale': scale, 'function': name, **result})
+            print(f"[{scale}] {name:<40} median={result['median_ms']:>10.3f} ms", file=sys.stderr)
+    finally:
+        await db.close_pool()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return results
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> list:
+    """Замеры, медиана которых выросла больше чем в threshold раз относительно baseline"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['scale'], r['function']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['scale'], result['function']))
+        if not previous or not previous['median_ms']:
+            continue
+        ratio = result['median_ms'] / previous['median_ms']
+        result['baseline_median_ms'] = previous['median_ms']
+        result['ratio'] = round(ratio, 3)
+        if ratio > threshold:
+            regressions.append(result)
+    return regressions
+
+
+async def run(args):
+    results = []
+    # Отладочные print из database.py не должны попасть в JSON на stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for scale in args.scales:
+            results.extend(await run_scale(scale, args))
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat_factor': args.repeat,
+        },
+        'results': results,
+    }
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    if args.compare:
+        report['regressions'] = [f"{r['scale']} {r['function']}: x{r['ratio']}" for r in regressions]
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['1k', '100k'])
+    parser.add_argument('--repeat', type=float, default=1.0, help='множитель числа повторов')
+    parser.add_argument('--db-dir', default=os.path.join('benchmarks', '.data'))
+    parser.add_argument('--output', help='файл для JSON с результатами (по умолчанию stdout)')
+    parser.add_argument('--compare', help='JSON прошлого запуска для сравнения')
+    parser.add_argument('--threshold', type=float, default=2.0,
+                        help='во сколько раз медиана может вырасти, прежде чем считается регрессией')
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Бенчмарк выбора обработчика для входящего обновления.
+
+Сравнивает три варианта кнопок меню: отдельный MessageHandler на каждую
+кнопку с фильтром на регулярном выражении, такой же MessageHandler с фильтром
+MenuButton (поиск по словарю MENU_BUTTONS) и один MenuHandler на состояние
+диалога, который ищет текст в словаре один раз. Для каждого варианта
+замеряет проверку всех кнопок меню и проход по всем обработчикам приложения
+до первого подходящего (так же, как это делает Application.process_update,
+но без вызова самих обработчиков): для пользователей вне диалогов и для
+пользователей в меню управления коробкой, где проверяются кнопки состояния
+MANAGE_BOX.
+
+CommandHandler сверяет имя бота, поэтому приложение инициализируется против
+заглушки Bot API из benchmarks.fake_telegram.
+
+Запуск из корня проекта:
+    python -m benchmarks.dispatch [--repeat 20000] [--api-port 8082]
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+
+from aiohttp import web
+
+from telegram import Update
+from telegram.ext import Application, ConversationHandler, DictPersistence, MessageHandler, filters
+
+import main as bot
+from handler.box_management_handler import MANAGE_BOX
+from handler.menu import MENU_BUTTONS, MenuButton, MenuHandler
+from benchmarks.fake_telegram import FakeBotApi, make_update
+
+# Обычный текст (ввод имени, адреса) проверяется всеми фильтрами меню и ни одним не принимается
+SAMPLE_TEXTS = list(MENU_BUTTONS) + ['Иван Иванов', 'г. Москва, ул. Ленина, д. 1', '/start']
+
+
+def regex_button(text: str):
+    return filters.Regex(f'^{re.escape(text)}$')
+
+
+def make_updates(bot):
+    return [Update.de_json(make_update(i, 100000 + i, text), bot) for i, text in enumerate(SAMPLE_TEXTS, 1)]
+
+
+def time_menu(handlers, updates, repeat: int) -> float:
+    """Среднее время (мкс) проверки одного обновления обработчиками всех кнопок меню"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for update in updates:
+            for handler in handlers:
+                if handler.check_update(update):
+                    break
+    return (time.perf_counter() - started) / (repeat * len(updates)) * 1e6
+
+
+def split_menu_handlers(handlers: list, button_factory):
+    """Замена MenuHandler в списке отдельными MessageHandler на каждую кнопку"""
+    handlers[:] = [
+        split for handler in handlers
+        for split in (
+            [MessageHandler(button_factory(text), callback) for text, callback in handler.callbacks.items()]
+            if isinstance(handler, MenuHandler) else [handler]
+        )
+    ]
+
+
+def managing_conversations(updates) -> str:
+    """Состояния диалогов для DictPersistence: авторы updates в меню управления коробкой"""
+    keys = {json.dumps([update.effective_chat.id, update.effective_user.id]) for update in updates}
+    return json.dumps({'box_management': {key: MANAGE_BOX for key in keys}})
+
+
+def build_application(button_factory, api_url: str, split_menus: bool, conversations: str = None):
+    """Приложение со всеми обработчиками бота, где кнопки меню заданы button_factory.
+    split_menus - MessageHandler на каждую кнопку вместо MenuHandler,
+    conversations - сохранённые состояния диалогов в формате DictPersistence"""
+    # Диалоги бота сохраняемые, поэтому нужна persistence; DictPersistence не трогает базу
+    application = (
+        Application.builder().token('123:abc').base_url(f"{api_url}/bot")
+        .persistence(DictPersistence(conversations_json=conversations or '')).updater(None).build()
+    )
+    original = bot.MenuButton
+    bot.MenuButton = button_factory
+    try:
+        bot.register_handlers(application)
+    finally:
+        bot.MenuButton = original
+    if split_menus:
+        for handlers in application.handlers.values():
+            split_menu_handlers(handlers, button_factory)
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    split_menu_handlers(handler.entry_points, button_factory)
+                    for state_handlers in handler.states.values():
+                        split_menu_handlers(state_handlers, button_factory)
+                    split_menu_handlers(handler.fallbacks, button_factory)
+    return application
+
+
+def select_handlers(application, update):
+    """Поиск обработчика в каждой группе, как в Application.process_update"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if handler.check_update(update) not in (None, False):
+                break
+
+
+def time_dispatch(application, updates, repeat: int) -> float:
+    """Среднее время (мкс) выбора обработчиков для одного обновления"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for update in updates:
+            select_handlers(application, update)
+    return (time.perf_counter() - started) / (repeat * len(updates)) * 1e6
+
+
+async def run(args):
+    api = FakeBotApi()
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.api_port).start()
+    api_url = f"http://127.0.0.1:{args.api_port}"
+
+    try:
+        callback = bot.show_settings
+        variants = (
+            ('regex', regex_button, True,
+             [MessageHandler(regex_button(text), callback) for text in MENU_BUTTONS]),
+            ('MenuButton', MenuButton, True,
+             [MessageHandler(MenuButton(text), callback) for text in MENU_BUTTONS]),
+            ('MenuHandler', MenuButton, False,
+             [MenuHandler({text: callback for text in MENU_BUTTONS})]),
+        )
+        for name, factory, split_menus, menu_handlers in variants:
+            application = build_application(factory, api_url, split_menus)
+            await application.initialize()
+            updates = make_updates(application.bot)
+            menu_us = time_menu(menu_handlers, updates, max(1, args.repeat // 10))
+            dispatch_us = time_dispatch(application, updates, args.repeat)
+            await application.shutdown()
+
+            application = build_application(factory, api_url, split_menus, managing_conversations(updates))
+            await application.initialize()
+            managing_us = time_dispatch(application, make_updates(application.bot), args.repeat)
+            await application.shutdown()
+            print(f"{name:>11}: кнопки меню {menu_us:6.2f} мкс/обновление, выбор обработчика "
+                  f"{dispatch_us:6.2f} мкс вне диалогов, {managing_us:6.2f} мкс в меню коробки")
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20000)
+    parser.add_argument('--api-port', type=int, default=8082)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
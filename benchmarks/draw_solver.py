@@ -0,0 +1,83 @@
+"""Бенчмарк жеребьевки с ограничениями.
+
+Запуск из корня проекта:
+    python -m benchmarks.draw_solver [--sizes 1000 5000] [--repeat 5]
+"""
+import argparse
+import random
+import time
+
+from draw import DrawUnsatisfiable, single_cycle, solve
+
+
+def sparse_case(n: int, rng: random.Random):
+    """Редкие ограничения: пары-домохозяйства и по 3 случайных исключения на участника"""
+    participants = list(range(n))
+    households = {user: user // 2 for user in participants}
+    forbidden = {(user, rng.randrange(n)) for user in participants for _ in range(3)}
+    return participants, forbidden, households
+
+
+def dense_case(n: int, rng: random.Random):
+    """Плотные ограничения: три больших домохозяйства (треть участников недоступна каждому)
+    и исключение пар прошлого года"""
+    participants = list(range(n))
+    households = {user: user % 3 for user in participants}
+    forbidden = set(single_cycle(participants, rng.random()))
+    return participants, forbidden, households
+
+
+def unsatisfiable_case(n: int, rng: random.Random):
+    """Невыполнимые ограничения, которые не ловятся быстрыми проверками:
+    трём участникам разрешено дарить только одному и тому же человеку"""
+    participants = list(range(n))
+    target = n - 1
+    forbidden = {(santa, recipient) for santa in range(3) for recipient in participants if recipient != target}
+    return participants, forbidden, {}
+
+
+CASES = {
+    'sparse': sparse_case,
+    'dense': dense_case,
+    'unsatisfiable': unsatisfiable_case,
+}
+
+
+def run_case(name: str, n: int, repeat: int) -> dict:
+    timings = []
+    outcome = 'ok'
+    for attempt in range(repeat):
+        rng = random.Random(attempt)
+        participants, forbidden, households = CASES[name](n, rng)
+        started = time.perf_counter()
+        try:
+            solve(participants, forbidden, households, seed=attempt)
+        except DrawUnsatisfiable:
+            outcome = 'unsatisfiable'
+        timings.append(time.perf_counter() - started)
+    return {
+        'case': name,
+        'participants': n,
+        'outcome': outcome,
+        'best_ms': round(min(timings) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        for name in CASES:
+            result = run_case(name, n, args.repeat)
+            print(
+                f"{result['case']:>14} n={result['participants']:<7} {result['outcome']:<14} "
+                f"best={result['best_ms']:>10.3f} ms  mean={result['mean_ms']:>10.3f} ms"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Локальный стенд "фейковый Telegram" для проверки бота в режиме webhook.
+
+Поднимает заглушку Bot API, отвечающую на вызовы бота, и отправляет на webhook
+бота синтетические обновления (команда /start от разных пользователей). Замеряет,
+за сколько бот принял обновления и ответил на каждое.
+
+Запуск (в двух терминалах, из корня проекта):
+    RUN_MODE=webhook TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+    python -m benchmarks.fake_telegram --updates 1000 --users 200
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'Secret Santa',
+    'username': 'secret_santa_test_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+
+class FakeBotApi:
+    """Заглушка Bot API: отвечает успехом на любой метод и считает вызовы"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.replies = 0
+        self.expected_replies = None
+        self.done = asyncio.Event()
+        self._message_id = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in ('sendMessage', 'sendPhoto', 'sendDocument', 'editMessageText'):
+            result = self._message(params)
+            if method != 'editMessageText':
+                self.replies += 1
+                if self.expected_replies and self.replies >= self.expected_replies:
+                    self.done.set()
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    def _message(self, params: dict) -> dict:
+        self._message_id += 1
+        chat_id = int(params.get('chat_id') or 0)
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text') or '',
+        }
+
+
+def make_update(update_id: int, user_id: int, text: str = '/start') -> dict:
+    """Синтетическое обновление с текстовым сообщением от пользователя"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'user{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+async def deliver_updates(webhook_url: str, updates, connections: int, secret: str = None) -> Counter:
+    """Отправка обновлений на webhook, как это делает Telegram: не больше connections параллельно"""
+    statuses = Counter()
+    pending = iter(updates)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async def worker(session):
+        for update in pending:
+            async with session.post(webhook_url, json=update, headers=headers) as response:
+                statuses[response.status] += 1
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(connections)))
+    return statuses
+
+
+async def run(args):
+    api = FakeBotApi()
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.api_port).start()
+
+    if args.wait_bot:
+        # Даём боту время подняться и вызвать getMe
+        print(f"Заглушка Bot API запущена на 127.0.0.1:{args.api_port}, ждём {args.wait_bot} с...")
+        await asyncio.sleep(args.wait_bot)
+
+    updates = [make_update(i, 100000 + i % args.users) for i in range(1, args.updates + 1)]
+    api.expected_replies = api.replies + len(updates)
+
+    started = time.perf_counter()
+    statuses = await deliver_updates(args.webhook_url, updates, args.connections, args.secret)
+    accepted = time.perf_counter() - started
+    try:
+        await asyncio.wait_for(api.done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    answered = time.perf_counter() - started
+
+    await runner.cleanup()
+    print(json.dumps({
+        'updates': len(updates),
+        'users': args.users,
+        'connections': args.connections,
+        'http_statuses': {str(code): count for code, count in statuses.items()},
+        'accepted_s': round(accepted, 3),
+        'answered_s': round(answered, 3),
+        'replies': api.replies,
+        'updates_per_s': round(len(updates) / answered, 1),
+        'api_calls': dict(api.calls),
+    }, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--webhook-url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default=None)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--connections', type=int, default=40)
+    parser.add_argument('--wait-bot', type=float, default=5.0, help='пауза перед отправкой обновлений')
+    parser.add_argument('--timeout', type=float, default=60.0, help='сколько ждать ответов бота')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Проверка холодного импорта бота.
+
+import main запускается в отдельном процессе (python -X importtime) из пустого
+временного каталога, без BOT_TOKEN и DB_PATH в окружении и с закрытым stdin.
+Проверяется, что импорт:
+- укладывается в бюджет времени;
+- ничего не спрашивает у пользователя и не падает без настроек;
+- не создаёт файлов и каталогов (базы, папки для фото и т.п.).
+Время импорта зависит от машины, поэтому берётся лучший из нескольких запусков.
+Выводит самые медленные модули проекта, код возврата 1 - проверка не пройдена.
+
+Запуск из корня проекта:
+    python -m benchmarks.import_time [--budget 1.5] [--runs 3] [--top 10]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Настройки, без которых импорт всё равно должен проходить
+STRIPPED_ENV = ('BOT_TOKEN', 'DB_PATH', 'RUN_MODE', 'TELEGRAM_API_URL')
+
+
+def project_modules() -> set:
+    """Имена модулей и пакетов верхнего уровня из корня проекта"""
+    names = set()
+    for entry in os.listdir(PROJECT_DIR):
+        if entry.endswith('.py'):
+            names.add(entry[:-3])
+        elif os.path.isdir(os.path.join(PROJECT_DIR, entry)) and not entry.startswith(('.', '_')):
+            names.add(entry)
+    return names
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Собственное и накопленное время импорта каждого модуля в микросекундах"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue                    # строка заголовка
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def import_once(module: str) -> dict:
+    env = {key: value for key, value in os.environ.items() if key not in STRIPPED_ENV}
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PROJECT_DIR, env.get('PYTHONPATH')]))
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=cwd, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=60
+        )
+        created = sorted(os.listdir(cwd))
+    return {
+        'returncode': result.returncode,
+        'stdout': result.stdout,
+        'stderr': result.stderr,
+        'created': created,
+        'modules': parse_importtime(result.stderr),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main', help='импортируемый модуль')
+    parser.add_argument('--budget', type=float, default=1.5, help='бюджет на импорт в секундах')
+    parser.add_argument('--runs', type=int, default=3, help='сколько раз повторить импорт')
+    parser.add_argument('--top', type=int, default=10, help='сколько медленных модулей проекта показать')
+    args = parser.parse_args()
+
+    failures = []
+    runs = [import_once(args.module) for _ in range(max(1, args.runs))]
+    for run in runs:
+        if run['returncode'] != 0:
+            errors = [line for line in run['stderr'].splitlines() if not line.startswith('import time:')]
+            failures.append(f"импорт завершился с кодом {run['returncode']}:\n" + '\n'.join(errors[-10:]))
+            break
+        if run['created']:
+            failures.append(f"импорт создал файлы в рабочем каталоге: {', '.join(run['created'])}")
+            break
+        if run['stdout']:
+            failures.append(f"импорт что-то вывел в stdout: {run['stdout'][:200]!r}")
+            break
+
+    if not failures:
+        best = min(runs, key=lambda run: run['modules'][args.module][1])
+        total = best['modules'][args.module][1] / 1_000_000
+        print(f"import {args.module}: {total:.3f} с (бюджет {args.budget:.3f} с, лучший из {len(runs)})")
+
+        own = project_modules()
+        slowest = sorted(
+            ((name, times) for name, times in best['modules'].items() if name.split('.')[0] in own),
+            key=lambda item: item[1][1], reverse=True
+        )
+        for name, (self_us, cumulative_us) in slowest[:args.top]:
+            print(f"  {name:<40} {cumulative_us / 1000:>9.1f} мс (собственное {self_us / 1000:.1f} мс)")
+
+        if total > args.budget:
+            failures.append(f"импорт {total:.3f} с превышает бюджет {args.budget:.3f} с")
+
+    for failure in failures:
+        print(f"ОШИБКА: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
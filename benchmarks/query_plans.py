@@ -0,0 +1,208 @@
+"""Проверка планов выполнения запросов database.py.
+
+SQL-строки извлекаются из исходного кода database.py (ast): все запросы,
+передаваемые в execute, executemany и execute_fetchall. Части f-строк
+подставляются так же, как их строит код: условия keyset_page - для первой,
+следующей и предыдущей страницы, списки IN (...) - несколькими параметрами.
+Для каждого варианта выполняется EXPLAIN QUERY PLAN на синтетической базе
+из benchmarks.seed (после ANALYZE, как в рабочей базе).
+
+Если запрос из HOT_FUNCTIONS (выполняются на каждое нажатие кнопки или в
+цикле рассылки) читает таблицу или индекс целиком (SCAN), проверка не
+пройдена. Проход по частичному индексу допустим: он читает только строки,
+подходящие под условие индекса. Полные проходы в остальных запросах только
+выводятся.
+Код возврата 1 - проверка не пройдена.
+
+Запуск из корня проекта:
+    python -m benchmarks.query_plans [--scale 1k] [--verbose]
+"""
+import argparse
+import ast
+import os
+import sqlite3
+import sys
+from contextlib import closing
+
+import database
+from benchmarks.seed import SCALES, seed_database
+
+# Функции, запросы которых должны идти только по индексам
+HOT_FUNCTIONS = {
+    'add_user', 'get_user_info', 'get_box_info', 'is_box_owner', 'is_participant',
+    'get_participant_info', 'add_participant', 'update_participant_info', 'remove_participant',
+    'get_participating_boxes', 'get_created_boxes', 'get_box_participants_page',
+    'count_box_participants', 'find_photo_copy', 'count_photo_references', 'set_box_photo_id',
+    'get_pending_messages', 'mark_messages', 'get_batch_progress',
+}
+EXECUTE_METHODS = ('execute', 'executemany', 'execute_fetchall')
+SQL_KEYWORDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+# Значения переменных, подставляемых в f-строки запросов
+SUBSTITUTIONS = {
+    'placeholders': ['?', '?, ?, ?'],
+    'field': ['user_wish'],
+}
+# Страницы keyset_page: первая, следующая и предыдущая
+KEYSET_PAGES = (
+    ('первая страница', {}),
+    ('следующая страница', {'after_id': 1}),
+    ('предыдущая страница', {'before_id': 1}),
+)
+
+
+def keyset_variants(function) -> list:
+    """Подстановки condition/tail для функции, которая вызывает keyset_page"""
+    for node in ast.walk(function):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id == 'keyset_page'):
+            column = ast.literal_eval(node.args[0])
+            options = {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords if kw.arg == 'descending'}
+            variants = []
+            for title, page in KEYSET_PAGES:
+                condition, _, tail, _ = database.keyset_page(column, 10, **page, **options)
+                variants.append((title, {'condition': condition, 'tail': tail}))
+            return variants
+    return []
+
+
+def render_fstring(node: ast.JoinedStr, function) -> list:
+    """Варианты текста f-строки: (подпись, SQL). Пустой список, если подстановка неизвестна."""
+    names = set()
+    for value in node.values:
+        if isinstance(value, ast.FormattedValue):
+            if not isinstance(value.value, ast.Name):
+                return []
+            names.add(value.value.id)
+
+    variants = [('', {})]
+    if names & {'condition', 'tail'}:
+        variants = keyset_variants(function)
+    for name in names - {'condition', 'tail'}:
+        if name not in SUBSTITUTIONS:
+            return []
+        variants = [
+            (f'{title}, {name}={value}'.strip(', ') if len(SUBSTITUTIONS[name]) > 1 else title,
+             {**values, name: value})
+            for title, values in variants for value in SUBSTITUTIONS[name]
+        ]
+
+    rendered = []
+    for title, values in variants:
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            else:
+                parts.append(values[value.value.id])
+        rendered.append((title, ''.join(parts)))
+    return rendered
+
+
+def extract_queries(path: str) -> list:
+    """Запросы из исходного кода: (функция, строка, подпись варианта, SQL)"""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    queries, skipped, seen = [], [], set()
+    # ast.walk обходит внешние функции раньше вложенных, поэтому запрос из вложенной
+    # функции (операции write_queue) приписывается внешней
+    for function in ast.walk(tree):
+        if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for node in ast.walk(function):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in EXECUTE_METHODS and node.args):
+                continue
+            if node.lineno in seen:
+                continue
+            seen.add(node.lineno)
+            sql = node.args[0]
+            if isinstance(sql, ast.Constant) and isinstance(sql.value, str):
+                variants = [('', sql.value)]
+            elif isinstance(sql, ast.JoinedStr):
+                variants = render_fstring(sql, function)
+            else:
+                continue                # PRAGMA из переменной и т.п.
+            if not variants:
+                skipped.append(f"{function.name}:{node.lineno}")
+            for title, text in variants:
+                if text.lstrip().upper().startswith(SQL_KEYWORDS):
+                    queries.append((function.name, node.lineno, title, text))
+    return queries, skipped
+
+
+def query_plan(db, sql: str) -> list:
+    # Значения параметров не влияют на план без STAT4, поэтому подставляем NULL
+    rows = db.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * sql.count('?')).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+
+def partial_indexes(db) -> set:
+    """Частичные индексы (CREATE INDEX ... WHERE): проход по ним читает только подходящие строки"""
+    rows = db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+    return {name for name, sql in rows if ' WHERE ' in ' '.join(sql.upper().split())}
+
+
+def full_scans(plan: list, partial: set) -> list:
+    """Строки плана с полным проходом по таблице или обычному индексу"""
+    scans = []
+    for line in map(str.strip, plan):
+        if not line.startswith('SCAN ') or line.startswith('SCAN CONSTANT ROW'):
+            continue
+        words = line.split()
+        if 'INDEX' in words and words[words.index('INDEX') + 1] in partial:
+            continue
+        scans.append(line)
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=list(SCALES), default='1k', help='размер синтетической базы')
+    parser.add_argument('--db-dir', default=os.path.join('benchmarks', '.data'))
+    parser.add_argument('--verbose', action='store_true', help='выводить планы всех запросов')
+    args = parser.parse_args()
+
+    queries, skipped = extract_queries(database.__file__)
+    path = seed_database(args.scale, args.db_dir)
+    failures, scans = [], []
+    with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as db:
+        partial = partial_indexes(db)
+        for function, lineno, title, sql in queries:
+            name = f"{function}:{lineno}" + (f" ({title})" if title else '')
+            try:
+                plan = query_plan(db, sql)
+            except sqlite3.Error as e:
+                failures.append(f"{name}: запрос не разбирается: {e}")
+                continue
+            found = full_scans(plan, partial)
+            if found and function in HOT_FUNCTIONS:
+                failures.append(f"{name}: полный проход в частом запросе: {'; '.join(found)}")
+            elif found:
+                scans.append(f"{name}: {'; '.join(found)}")
+            if args.verbose or (found and function in HOT_FUNCTIONS):
+                print(f"{name}\n  {' '.join(sql.split())}")
+                print('\n'.join(f"    {line}" for line in plan))
+
+    missing = HOT_FUNCTIONS - {function for function, *_ in queries}
+    for function in sorted(missing):
+        failures.append(f"{function}: нет запросов в database.py, обновите HOT_FUNCTIONS")
+    for name in skipped:
+        failures.append(f"{name}: неизвестная подстановка в f-строке запроса, дополните SUBSTITUTIONS")
+
+    print(f"Проверено запросов: {len(queries)}, частых функций: {len(HOT_FUNCTIONS)}")
+    if scans:
+        print("Полные проходы в редких запросах:")
+        print('\n'.join(f"  {line}" for line in scans))
+    for failure in failures:
+        print(f"ОШИБКА: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Синтетические базы данных для бенчмарков.
+
+База создаётся схемой из database.init_db и заполняется одной транзакцией.
+Готовый файл переиспользуется при следующих запусках: заполнение базы на
+1 млн пользователей занимает заметное время.
+
+Раскладка данных (id детерминированы, поэтому результаты сравнимы между запусками):
+- пользователи 1..users;
+- коробка 1 (BIG_BOX) - большая коробка с big_box участниками, пользователи 1..big_box,
+  с домохозяйствами по 4 человека и исключёнными парами;
+- остальные коробки по box_size участников, каждый пользователь ровно в одной из них;
+  в каждой одно домохозяйство из двух первых участников и одна исключённая пара;
+  первые OWNER_BOXES маленьких коробок создал пользователь 1 (POWER_USER);
+- пакет рассылки из OUTBOX_MESSAGES сообщений, из которых последние OUTBOX_PENDING
+  ещё не отправлены (как в рабочей базе, где очередь - хвост истории рассылок);
+- сохранённые user_data каждого десятого пользователя.
+"""
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from database import init_db
+
+SCALES = {
+    '1k': {'users': 1_000, 'big_box': 500, 'box_size': 20},
+    '100k': {'users': 100_000, 'big_box': 10_000, 'box_size': 20},
+    '1m': {'users': 1_000_000, 'big_box': 10_000, 'box_size': 20},
+}
+
+BIG_BOX = 1
+FIRST_SMALL_BOX = 2
+POWER_USER = 1
+OWNER_BOXES = 40
+OUTBOX_MESSAGES = 10_000
+OUTBOX_PENDING = 1_000
+HOUSEHOLD_SIZE = 4
+# Меняется при изменении раскладки, чтобы не использовать старые заполненные базы
+SEED_VERSION = 3
+
+
+def layout(scale: str) -> dict:
+    """Параметры раскладки: какие id есть в базе данного размера"""
+    params = SCALES[scale]
+    small_boxes = -(-params['users'] // params['box_size'])
+    return {
+        'scale': scale,
+        **params,
+        'big_box_id': BIG_BOX,
+        'small_box_id': FIRST_SMALL_BOX,
+        'small_boxes': small_boxes,
+        'last_box_id': FIRST_SMALL_BOX + small_boxes - 1,
+        'power_user': POWER_USER,
+    }
+
+
+def _small_box(user_id: int, box_size: int) -> int:
+    return FIRST_SMALL_BOX + (user_id - 1) // box_size
+
+
+def _seed(db, info: dict):
+    users, big_box, box_size = info['users'], info['big_box'], info['box_size']
+    now = datetime.now()
+    date = now.strftime('%Y-%m-%d %H:%M:%S')
+
+    db.executemany(
+        "INSERT INTO users (user_id, username, connection_date) VALUES (?, ?, ?)",
+        ((user_id, f'user{user_id}', date) for user_id in range(1, users + 1))
+    )
+
+    def box_owner(id_box):
+        if id_box < FIRST_SMALL_BOX + OWNER_BOXES:
+            return POWER_USER
+        return (id_box - FIRST_SMALL_BOX) * box_size + 1
+
+    db.execute(
+        "INSERT INTO santa_box (id_box, user_id, box_name, box_desc) VALUES (?, ?, ?, ?)",
+        (BIG_BOX, POWER_USER, 'Большая коробка', 'Коробка для бенчмарка')
+    )
+    db.executemany(
+        "INSERT INTO santa_box (id_box, user_id, box_name, box_desc, box_photo_unique_id) VALUES (?, ?, ?, ?, ?)",
+        (
+            (id_box, box_owner(id_box), f'Коробка {id_box}', 'Описание коробки', f'photo{id_box}')
+            for id_box in range(FIRST_SMALL_BOX, info['last_box_id'] + 1)
+        )
+    )
+
+    def wishes():
+        for user_id in range(1, big_box + 1):
+            yield user_id, f'Участник {user_id}', 'Хочу тёплые носки', f'Город, улица {user_id}', BIG_BOX
+        for user_id in range(1, users + 1):
+            yield (user_id, f'Участник {user_id}', 'Хочу книгу', f'Город, улица {user_id}',
+                   _small_box(user_id, box_size))
+
+    db.executemany(
+        "INSERT INTO user_wish (user_id, user_name, user_wish, user_adds, id_box) VALUES (?, ?, ?, ?, ?)",
+        wishes()
+    )
+
+    # Первые участники маленьких коробок: user_id = (id_box - FIRST_SMALL_BOX) * box_size + 1
+    small_firsts = [
+        (id_box, (id_box - FIRST_SMALL_BOX) * box_size + 1)
+        for id_box in range(FIRST_SMALL_BOX, info['last_box_id'] + 1)
+        if (id_box - FIRST_SMALL_BOX) * box_size + 2 <= users
+    ]
+    db.executemany(
+        "INSERT INTO draw_household (id_box, user_id, household) VALUES (?, ?, ?)",
+        ((BIG_BOX, user_id, f'h{(user_id - 1) // HOUSEHOLD_SIZE}') for user_id in range(1, big_box + 1))
+    )
+    db.executemany(
+        "INSERT INTO draw_household (id_box, user_id, household) VALUES (?, ?, ?)",
+        ((id_box, first + k, f'b{id_box}') for id_box, first in small_firsts for k in range(2))
+    )
+    db.executemany(
+        "INSERT INTO draw_exclusion (id_box, santa_id, recipient_id) VALUES (?, ?, ?)",
+        ((BIG_BOX, user_id, big_box + 1 - user_id) for user_id in range(1, big_box + 1, 10))
+    )
+    db.executemany(
+        "INSERT INTO draw_exclusion (id_box, santa_id, recipient_id) VALUES (?, ?, ?)",
+        ((id_box, first + 1, first + 2) for id_box, first in small_firsts if first + 2 <= users)
+    )
+
+    cursor = db.execute(
+        "INSERT INTO outbox_batch (title, report_chat_id, created_at, id_box) VALUES (?, ?, ?, ?)",
+        ('Рассылка для бенчмарка', POWER_USER, date, BIG_BOX)
+    )
+    db.executemany(
+        "INSERT INTO outbox (id_batch, chat_id, text, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (
+            (cursor.lastrowid, (i % users) + 1, 'Текст уведомления',
+             'pending' if i >= OUTBOX_MESSAGES - OUTBOX_PENDING else 'sent', date)
+            for i in range(OUTBOX_MESSAGES)
+        )
+    )
+
+    # Половина сохранённых данных устарела и попадёт под удаление
+    stale = (now - timedelta(days=365)).strftime('%Y-%m-%d %H:%M:%S')
+    db.executemany(
+        "INSERT INTO persistent_user_data (user_id, data, updated_at) VALUES (?, ?, ?)",
+        (
+            (user_id, '{"current_box_id": 1}', stale if user_id % 20 == 0 else date)
+            for user_id in range(10, users + 1, 10)
+        )
+    )
+
+
+def seed_database(scale: str, db_dir: str) -> str:
+    """Путь к базе данного размера. Если её ещё нет, она создаётся и заполняется."""
+    os.makedirs(db_dir, exist_ok=True)
+    path = os.path.join(db_dir, f'bench_{scale}.v{SEED_VERSION}.db')
+    if os.path.exists(path):
+        return path
+
+    # Заполняем временный файл и переименовываем его только после успеха,
+    # чтобы прерванное заполнение не оставило неполную базу
+    tmp_path = f'{path}.tmp'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(tmp_path + suffix):
+            os.remove(tmp_path + suffix)
+    init_db(tmp_path)
+    with closing(sqlite3.connect(tmp_path)) as db:
+        with db:
+            _seed(db, layout(scale))
+        db.execute("ANALYZE")
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,111 @@
+"""Бенчмарк групповой записи (database.write_queue).
+
+Множество одновременных add_user и add_participant, как при наплыве
+регистраций, выполняется дважды: с групповым коммитом и с коммитом на каждую
+операцию (окно 0 и одна операция в транзакции). Для каждого режима выводится
+число операций в секунду и средний размер транзакции. --synchronous задаёт
+режим, в котором писатель коммитит транзакции; по умолчанию, как в боте,
+FULL - каждый коммит ждёт fsync.
+
+База создаётся заново во временном каталоге.
+
+Запуск из корня проекта:
+    python -m benchmarks.write_queue [--operations 5000] [--concurrency 200] [--synchronous FULL]
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import database as db
+from group_commit import GroupCommitWriter, WRITE_BATCH_SIZE, WRITE_BATCH_WINDOW, WRITE_SYNCHRONOUS
+
+NOW = '2030-01-01 00:00:00'
+BOX_ID = 1
+
+
+async def run_mode(title: str, writer: GroupCommitWriter, args, offset: int) -> dict:
+    db.write_queue = writer
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def signup(i):
+        async with semaphore:
+            user_id = offset + i
+            await db.add_user(user_id, f'user{user_id}', NOW)
+            await db.add_participant(user_id, f'Участник {user_id}', 'Адрес', BOX_ID, 'Пожелание')
+
+    started = time.perf_counter()
+    await asyncio.gather(*(signup(i) for i in range(args.operations)))
+    elapsed = time.perf_counter() - started
+    await writer.stop()
+
+    operations = args.operations * 2
+    return {
+        'mode': title,
+        'ops_per_s': round(operations / elapsed),
+        'elapsed_s': round(elapsed, 3),
+        'transactions': writer.batches,
+        'avg_batch': round(writer.operations / max(1, writer.batches), 1),
+    }
+
+
+async def check_isolation():
+    """Ошибка одной операции не откатывает остальные операции той же транзакции"""
+    results = await asyncio.gather(
+        db.add_participant(10**9, 'Первый', 'Адрес', BOX_ID, 'Пожелание'),
+        db.add_participant(10**9, 'Повтор', 'Адрес', BOX_ID, 'Пожелание'),
+        db.add_participant(10**9 + 1, 'Второй', 'Адрес', BOX_ID, 'Пожелание'),
+        return_exceptions=True
+    )
+    errors = [type(result).__name__ for result in results if isinstance(result, Exception)]
+    saved = await db.is_participant(10**9, BOX_ID) and await db.is_participant(10**9 + 1, BOX_ID)
+    if errors != ['IntegrityError'] or not saved:
+        raise AssertionError(f"ошибка повторного вступления затронула другие записи: {errors}, сохранены: {saved}")
+
+
+async def run(args, path: str):
+    await db.init_pool(path)
+    await db.add_box(1, 'Коробка', None, 'Описание')
+    original = db.write_queue
+    try:
+        results = [
+            await run_mode('по одной', GroupCommitWriter(
+                db.get_connection, window=0, max_batch=1, synchronous=args.synchronous
+            ), args, 0),
+            await run_mode('группами', GroupCommitWriter(
+                db.get_connection, synchronous=args.synchronous
+            ), args, args.operations),
+        ]
+        db.write_queue = GroupCommitWriter(db.get_connection)
+        await check_isolation()
+    finally:
+        db.write_queue = original
+        await db.close_pool()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=5000, help='число регистраций (add_user + add_participant)')
+    parser.add_argument('--concurrency', type=int, default=200, help='одновременных регистраций')
+    parser.add_argument('--synchronous', choices=['OFF', 'NORMAL', 'FULL'], default=WRITE_SYNCHRONOUS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Отладочные print из database.py не смешиваются с результатом
+        with contextlib.redirect_stdout(sys.stderr):
+            results = asyncio.run(run(args, os.path.join(tmp, 'write_queue.db')))
+    print(f"SQLite {sqlite3.sqlite_version}, synchronous={args.synchronous}, "
+          f"окно {WRITE_BATCH_WINDOW * 1000:g} мс, до {WRITE_BATCH_SIZE} операций в транзакции")
+    for result in results:
+        print(f"{result['mode']:>10}: {result['ops_per_s']:>7} операций/с, {result['elapsed_s']:>7} с, "
+              f"транзакций {result['transactions']}, в среднем {result['avg_batch']} операций")
+    print("Ошибка одной операции не затрагивает остальные: да")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import asyncio
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+import os
+from datetime import datetime, timedelta
+from database import (
+    get_batch_progress,
+    get_pending_messages,
+    mark_messages,
+    purge_outbox,
+    queue_messages,
+    set_batch_report_message
+)
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и не чаще 1 сообщения в секунду в один чат
+GLOBAL_RATE = 30
+PER_CHAT_INTERVAL = 1.0
+# Сколько сообщений отправляется одновременно
+MAX_CONCURRENCY = 10
+# Сколько раз повторяем отправку при флуд-контроле и сетевых ошибках
+MAX_ATTEMPTS = 5
+# Как часто (в секундах) обновляем сообщение о прогрессе у организатора
+PROGRESS_INTERVAL = 3.0
+# Сколько сообщений outbox берём за один проход и как часто проверяем очередь без сигнала
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_INTERVAL = 5.0
+# Через сколько дней отправленные и недоставленные сообщения удаляются из outbox:
+# тексты рассылок содержат адреса и пожелания участников
+OUTBOX_RETENTION_DAYS = float(os.getenv('OUTBOX_RETENTION_DAYS') or 7)
+# Как часто (в секундах) удаляем старые сообщения
+OUTBOX_PURGE_INTERVAL = 3600.0
+
+
+class RateLimiter:
+    """Планировщик отправки: общий лимит бота и минимальный интервал для каждого чата"""
+
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL):
+        self.interval = 1 / rate
+        self.per_chat_interval = per_chat_interval
+        self._next_slot = 0.0
+        self._chat_slots = {}
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    async def acquire(self, chat_id: int):
+        """Ждёт, пока можно отправить сообщение в чат, не нарушая лимиты"""
+        now = self._now()
+        # Резервируем слот сразу, без ожидания, поэтому блокировка не нужна
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        slot = max(slot, self._chat_slots.get(chat_id, 0.0))
+        self._chat_slots[chat_id] = slot + self.per_chat_interval
+
+        if len(self._chat_slots) > 10000:
+            self._chat_slots = {
+                chat: chat_slot for chat, chat_slot in self._chat_slots.items() if chat_slot > now
+            }
+
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Приостанавливает все отправки после ответа RetryAfter"""
+        self._next_slot = max(self._next_slot, self._now() + seconds)
+
+
+# Один ограничитель на процесс: лимиты Telegram считаются на бота, а не на рассылку
+limiter = RateLimiter()
+
+
+async def send_with_retry(bot, chat_id: int, text: str, **kwargs) -> bool:
+    """Отправка одного сообщения с повторами. Возвращает True, если сообщение доставлено."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await limiter.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            return True
+        except RetryAfter as e:
+            # Флуд-контроль действует на весь бот, поэтому тормозим всех отправителей
+            limiter.pause(e.retry_after)
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или чат недоступен: повтор не поможет
+            print(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+            return False
+        except NetworkError as e:
+            print(f"Сетевая ошибка при отправке пользователю {chat_id} (попытка {attempt}): {e}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+        except TelegramError as e:
+            print(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+            return False
+    print(f"Не удалось отправить сообщение пользователю {chat_id} после {MAX_ATTEMPTS} попыток")
+    return False
+
+
+class OutboxWorker:
+    """Фоновая отправка сообщений из таблицы outbox.
+
+    Сообщение помечается отправленным только после успешной отправки, поэтому
+    после перезапуска бота рассылка продолжается с неотправленных сообщений
+    (доставка "как минимум один раз").
+    """
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._bot = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._last_report = {}
+        self._next_purge = 0.0
+
+    def start(self, bot):
+        """Запуск обработки очереди. Вызывается после открытия пула соединений."""
+        self._bot = bot
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Сигнал о том, что в очереди появились новые сообщения"""
+        self._wakeup.set()
+
+    async def stop(self, timeout: float = 10.0):
+        """Остановка: дожидаемся отправки уже взятых сообщений, остальные останутся в очереди"""
+        if not self._task:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._task = None
+
+    async def _purge(self):
+        """Удаление старых отправленных сообщений не чаще раза в OUTBOX_PURGE_INTERVAL"""
+        now = asyncio.get_running_loop().time()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + OUTBOX_PURGE_INTERVAL
+        before = (datetime.now() - timedelta(days=OUTBOX_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+        removed = await purge_outbox(before)
+        if removed:
+            print(f"Удалены старые сообщения рассылок: {removed}")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self._purge()
+                messages = await get_pending_messages(self.batch_size)
+                if messages:
+                    await self._send_batch(messages)
+                    continue
+            except Exception as e:
+                print(f"Ошибка обработки очереди рассылки: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_batch(self, messages):
+        pending = iter(messages)
+        results = []
+
+        async def worker():
+            for message in pending:
+                delivered = await send_with_retry(self._bot, message['chat_id'], message['text'])
+                results.append((message['id'], delivered))
+
+        await asyncio.gather(*(worker() for _ in range(min(MAX_CONCURRENCY, len(messages)))))
+        # Результаты всей порции сохраняем одной транзакцией
+        await mark_messages(results)
+        for id_batch in {message['id_batch'] for message in messages}:
+            await self._report_progress(id_batch)
+
+    async def _report_progress(self, id_batch: int):
+        """Создание или обновление у организатора сообщения с прогрессом рассылки"""
+        progress = await get_batch_progress(id_batch)
+        if not progress or not progress['report_chat_id']:
+            return
+        done = progress['pending'] == 0
+        now = asyncio.get_running_loop().time()
+        if not done and now - self._last_report.get(id_batch, 0.0) < PROGRESS_INTERVAL:
+            return
+        self._last_report[id_batch] = now
+        if done:
+            self._last_report.pop(id_batch, None)
+
+        title = progress['title'] or "Рассылка"
+        text = f"✅ {title} завершена" if done else f"📤 {title}..."
+        text += f"\n\nОтправлено: {progress['sent']} из {progress['total']}"
+        if progress['failed']:
+            text += f"\nНе доставлено: {progress['failed']}"
+
+        try:
+            if progress['report_message_id']:
+                await self._bot.edit_message_text(
+                    text,
+                    chat_id=progress['report_chat_id'],
+                    message_id=progress['report_message_id']
+                )
+            else:
+                message = await self._bot.send_message(chat_id=progress['report_chat_id'], text=text)
+                await set_batch_report_message(id_batch, message.message_id)
+        except Exception as e:
+            print(f"Не удалось обновить прогресс рассылки {id_batch}: {e}")
+
+
+# Один обработчик очереди на процесс
+outbox_worker = OutboxWorker()
+
+
+async def queue_broadcast(messages, report_chat_id: int = None, title: str = "Рассылка", id_box: int = None) -> int:
+    """Постановка рассылки в outbox. messages - список пар (chat_id, text).
+    Если передан report_chat_id, организатор получает сообщение с прогрессом.
+    Рассылка коробки id_box удаляется вместе с коробкой."""
+    id_batch = await queue_messages(messages, title=title, report_chat_id=report_chat_id, id_box=id_box)
+    outbox_worker.wake()
+    return id_batch
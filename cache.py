@@ -0,0 +1,87 @@
+import inspect
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+class TTLCache:
+    """Ограниченный по размеру кэш с временем жизни записей и вытеснением LRU.
+
+    generation увеличивается при каждой инвалидации: значение, прочитанное
+    из базы до неё, set с прежним поколением не сохраняет.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """Возвращает пару (найдено ли, значение)"""
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._data[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, key, value, generation: int = None):
+        """Сохранение значения. generation - поколение кэша на момент начала чтения значения"""
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Удаление всех записей, ключ которых удовлетворяет условию"""
+        self.generation += 1
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
+def cached(cache: TTLCache):
+    """Кэширование результата асинхронной функции по её аргументам.
+
+    Ключ - кортеж значений аргументов в порядке объявления, поэтому вызовы
+    с позиционными и именованными аргументами попадают в одну запись.
+    Возвращаемые значения общие для всех вызывающих и не должны изменяться.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = args if not kwargs else tuple(signature.bind(*args, **kwargs).arguments.values())
+            found, value = cache.get(key)
+            if found:
+                return value
+            # Если во время запроса была запись с инвалидацией, прочитанное значение
+            # могло устареть: возвращаем его, но не кэшируем
+            generation = cache.generation
+            value = await func(*args, **kwargs)
+            cache.set(key, value, generation)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
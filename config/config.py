@@ -1,9 +1,41 @@
+import argparse
 import os
 from dotenv import load_dotenv
 
-# Загружаем переменные окружения из файла .env
-load_dotenv(os.path.join("config", ".env"))
+# Необязательный файл с переменными окружения для локального запуска
+ENV_FILE = os.path.join("config", ".env")
+# База данных по умолчанию, если путь не задан ни аргументом, ни переменной DB_PATH
+DEFAULT_DB_PATH = "santa_bot.db"
+RUN_MODES = ("polling", "webhook")
 
-# Получаем значения из переменных окружения
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-DB_PATH = os.getenv("DB_PATH")
+
+def load_env_file(path: str = ENV_FILE):
+    """Загрузка переменных из .env, если файл есть. Уже заданные переменные окружения не перезаписываются."""
+    load_dotenv(path)
+
+
+def load_config(argv=None) -> dict:
+    """Настройки запуска из аргументов командной строки и переменных окружения.
+
+    Аргументы имеют приоритет над переменными окружения. Ничего не спрашивает
+    у пользователя: без токена бота завершает работу с ошибкой.
+    """
+    parser = argparse.ArgumentParser(description="Telegram-бот Secret Santa")
+    parser.add_argument("--token", default=os.getenv("BOT_TOKEN"),
+                        help="токен бота от @BotFather (по умолчанию BOT_TOKEN)")
+    parser.add_argument("--db-path", default=os.getenv("DB_PATH") or DEFAULT_DB_PATH,
+                        help=f"путь к файлу базы данных (по умолчанию DB_PATH или {DEFAULT_DB_PATH})")
+    parser.add_argument("--mode", choices=RUN_MODES, default=os.getenv("RUN_MODE") or "polling",
+                        help="режим получения обновлений (по умолчанию RUN_MODE или polling)")
+    parser.add_argument("--api-url", default=os.getenv("TELEGRAM_API_URL"),
+                        help="адрес Bot API для локального сервера или тестового стенда (TELEGRAM_API_URL)")
+    args = parser.parse_args(argv)
+
+    if not args.token:
+        parser.error("не задан токен бота: укажите --token или переменную окружения BOT_TOKEN")
+    return {
+        "token": args.token,
+        "db_path": args.db_path,
+        "mode": args.mode,
+        "api_url": args.api_url,
+    }
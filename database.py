@@ -1,177 +1,410 @@
+import asyncio
 import aiosqlite
 import sqlite3
 import os
-from dotenv import load_dotenv
+from datetime import datetime
+from contextlib import asynccontextmanager, closing
+from draw import DrawUnsatisfiable, solve
+from cache import TTLCache, cached
+from config.config import DEFAULT_DB_PATH
+from metrics import add_gauges, instrument_module
+from query_log import SLOW_QUERY_MS, TracedConnection
+from group_commit import GroupCommitWriter
 
-def get_env_values():
-    """Получение значений из переменных окружения"""
-    load_dotenv(os.path.join('config', '.env'))
-    return {
-        'BOT_TOKEN': os.getenv('BOT_TOKEN'),
-        'DB_PATH': os.getenv('DB_PATH')
-    }
+# Настройки SQLite, которые действуют в пределах одного соединения
+DB_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",    # в режиме WAL fsync нужен только при checkpoint
+    "PRAGMA mmap_size = 268435456",   # 256 МБ файла читаются через mmap
+    "PRAGMA cache_size = -65536",     # 64 МБ кэша страниц (отрицательное значение - в КБ)
+    "PRAGMA temp_store = MEMORY",
+)
 
-def init_env():
-    """Инициализация файла .env, если он отсутствует"""
-    env_path = os.path.join('config', '.env')
-    
-    if not os.path.exists('config'):
-        os.makedirs('config')
-    
-    # Проверяем существование файла и наличие необходимых переменных
-    env_values = get_env_values()
-    if not os.path.exists(env_path) or not all([env_values['BOT_TOKEN'], env_values['DB_PATH']]):
-        print("\n=== Настройка конфигурации бота ===")
-        
-        # Получаем существующие значения, если они есть
-        existing_token = env_values['BOT_TOKEN'] or ''
-        existing_db_path = env_values['DB_PATH'] or 'santa_bot.db'
-        
-        # Запрашиваем BOT_TOKEN
-        while True:
-            bot_token = input(f"\nВведите токен бота (текущий: {existing_token or 'отсутствует'})\n"
-                            "Получить токен можно у @BotFather в Telegram: ")
-            if bot_token.strip():
-                break
-            print("❌ Токен не может быть пустым!")
-        
-        # Запрашиваем DB_PATH
-        db_path = input(f"\nВведите путь к файлу базы данных (Enter для значения по умолчанию: {existing_db_path})\n"
-                       "Путь к базе данных: ")
-        db_path = db_path.strip() if db_path.strip() else existing_db_path
-        
-        # Записываем значения в файл .env
-        with open(env_path, 'w', encoding='utf-8') as f:
-            f.write(f"BOT_TOKEN={bot_token}\n")
-            f.write(f"DB_PATH={db_path}\n")
-        
-        print("\n✅ Файл конфигурации успешно создан!")
-        
-        # Создаем или обновляем config.py
-        config_path = os.path.join('config', 'config.py')
-        with open(config_path, 'w', encoding='utf-8') as f:
-            f.write('import os\n')
-            f.write('from dotenv import load_dotenv\n\n')
-            f.write('# Загружаем переменные окружения из файла .env\n')
-            f.write('load_dotenv(os.path.join("config", ".env"))\n\n')
-            f.write('# Получаем значения из переменных окружения\n')
-            f.write('BOT_TOKEN = os.getenv("BOT_TOKEN")\n')
-            f.write('DB_PATH = os.getenv("DB_PATH")\n')
-        
-        # Перезагружаем переменные окружения
-        return get_env_values()
-    else:
-        print("✅ Конфигурация загружена успешно")
-        return env_values
+# Миграции схемы: (версия, SQL). Номер последней применённой миграции
+# хранится в PRAGMA user_version. Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    # 1. Исходная схема. IF NOT EXISTS позволяет принять существующие базы без версии
+    (1, """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        connection_date TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS santa_recipient (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        santa_id INTEGER,
+        recipient_id INTEGER,
+        id_box INTEGER,
+        FOREIGN KEY (santa_id) REFERENCES users(user_id),
+        FOREIGN KEY (recipient_id) REFERENCES users(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS user_wish (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        user_name TEXT,
+        user_wish TEXT,
+        user_adds TEXT,
+        id_box INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS santa_box (
+        id_box INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        box_name TEXT,
+        box_photo TEXT,
+        box_desc TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    );
+    """),
+    # 2. Индексы под горячие запросы и уникальность участника в коробке
+    (2, """
+    DELETE FROM user_wish
+    WHERE id NOT IN (SELECT MIN(id) FROM user_wish GROUP BY user_id, id_box);
+
+    DELETE FROM santa_recipient
+    WHERE id NOT IN (SELECT MIN(id) FROM santa_recipient GROUP BY id_box, santa_id);
+
+    -- is_participant, get_participant_info, get_participating_boxes
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_user_wish_user_box ON user_wish (user_id, id_box);
+    -- get_box_participants, create_santa_pairs, delete_box
+    CREATE INDEX IF NOT EXISTS idx_user_wish_box ON user_wish (id_box);
+    -- get_created_boxes (сортировка по id_box берётся из rowid индекса)
+    CREATE INDEX IF NOT EXISTS idx_santa_box_user ON santa_box (user_id);
+    -- delete_box, create_santa_pairs, remove_participant (ветка santa_id)
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_santa_recipient_box_santa ON santa_recipient (id_box, santa_id);
+    -- remove_participant (ветка recipient_id)
+    CREATE INDEX IF NOT EXISTS idx_santa_recipient_box_recipient ON santa_recipient (id_box, recipient_id);
+    """),
+    # 3. Очередь исходящих сообщений (outbox) для рассылок
+    (3, """
+    CREATE TABLE IF NOT EXISTS outbox_batch (
+        id_batch INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        report_chat_id INTEGER,
+        report_message_id INTEGER,
+        created_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        id_batch INTEGER,
+        chat_id INTEGER,
+        text TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT,
+        FOREIGN KEY (id_batch) REFERENCES outbox_batch(id_batch)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (id) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS idx_outbox_batch_status ON outbox (id_batch, status);
+    """),
+    # 4. Ограничения жеребьевки: исключённые пары, домохозяйства и коробка прошлого года
+    (4, """
+    CREATE TABLE IF NOT EXISTS draw_exclusion (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        id_box INTEGER NOT NULL,
+        santa_id INTEGER NOT NULL,
+        recipient_id INTEGER NOT NULL,
+        UNIQUE (id_box, santa_id, recipient_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS draw_household (
+        id_box INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        household TEXT NOT NULL,
+        PRIMARY KEY (id_box, user_id)
+    );
+
+    -- Пары из коробки прошлого года не повторяются
+    ALTER TABLE santa_box ADD COLUMN prev_box_id INTEGER;
+    """),
+    # 5. Фото коробки хранится как file_id Telegram, локальная копия необязательна
+    (5, """
+    ALTER TABLE santa_box ADD COLUMN box_photo_id TEXT;
+    ALTER TABLE santa_box ADD COLUMN box_photo_unique_id TEXT;
+
+    CREATE INDEX IF NOT EXISTS idx_santa_box_photo_unique ON santa_box (box_photo_unique_id);
+    """),
+    # 6. Состояние диалогов и user_data бота (persistence.py)
+    (6, """
+    CREATE TABLE IF NOT EXISTS persistent_user_data (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS persistent_conversation (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (name, key)
+    );
+
+    -- Загрузка свежих записей при старте и удаление устаревших
+    CREATE INDEX IF NOT EXISTS idx_persistent_user_data_updated ON persistent_user_data (updated_at);
+    CREATE INDEX IF NOT EXISTS idx_persistent_conversation_updated ON persistent_conversation (updated_at);
+    """),
+    # 7. Поиск коробок, ссылающихся на локальный файл фото, при удалении коробки
+    (7, """
+    CREATE INDEX IF NOT EXISTS idx_santa_box_photo ON santa_box (box_photo) WHERE box_photo IS NOT NULL;
+    """),
+    # 8. Рассылки привязаны к коробке (удаляются вместе с ней), отправленные сообщения удаляются по сроку
+    (8, """
+    ALTER TABLE outbox_batch ADD COLUMN id_box INTEGER;
+
+    CREATE INDEX IF NOT EXISTS idx_outbox_batch_box ON outbox_batch (id_box) WHERE id_box IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_outbox_finished ON outbox (updated_at) WHERE status != 'pending';
+    """),
+]
+
+def apply_pragmas(db):
+    """Применение настроек производительности к соединению sqlite3"""
+    for pragma in DB_PRAGMAS:
+        db.execute(pragma)
+
+def migrate(db) -> int:
+    """Применение недостающих миграций. Возвращает итоговую версию схемы."""
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for target, script in MIGRATIONS:
+        if target <= version:
+            continue
+        print(f"Применяем миграцию базы данных {target}...")
+        # Каждая миграция выполняется в своей транзакции вместе с обновлением версии
+        db.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {target};\nCOMMIT;")
+        version = target
+    return version
 
 def init_db(db_path):
-    """Инициализация базы данных: создание файла и таблиц, если они отсутствуют."""
+    """Инициализация базы данных: включение WAL и применение миграций схемы."""
     if not os.path.exists(db_path):
         print("База данных не найдена. Создаём новую базу данных...")
-        with sqlite3.connect(db_path) as db:
-            cursor = db.cursor()
-
-            # Таблица пользователей
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                connection_date TEXT
-            )
-            """)
-
-            # Таблица для связывания Санты и получателя
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS santa_recipient (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                santa_id INTEGER,
-                recipient_id INTEGER,
-                id_box INTEGER,
-                FOREIGN KEY (santa_id) REFERENCES users(user_id),
-                FOREIGN KEY (recipient_id) REFERENCES users(user_id)
-            )
-            """)
-
-            # Таблица для желаний пользователей
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_wish (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                user_name TEXT,
-                user_wish TEXT,
-                user_adds TEXT,
-                id_box INTEGER,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """)
-
-            # Таблица для коробок
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS santa_box (
-                id_box INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                box_name TEXT,
-                box_photo TEXT,
-                box_desc TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """)
-
-            db.commit()
-
-def init_app():
-    """Инициализация приложения: создание необходимых файлов и папок"""
-    print("\n=== Инициализация приложения ===")
-    env_values = init_env()  # Инициализация .env и получение значений
-    init_db(env_values['DB_PATH'])   # Инициализация базы данных с явной передачей пути
-    print("\n=== Инициализация завершена ===\n")
-    return env_values
-
-# Инициализируем значения при импорте модуля
-ENV_VALUES = init_app()
-DB_PATH = ENV_VALUES['DB_PATH']
+    with closing(sqlite3.connect(db_path)) as db:
+        # Режим журнала сохраняется в файле базы, поэтому достаточно включить его один раз
+        db.execute("PRAGMA journal_mode = WAL")
+        apply_pragmas(db)
+        version = migrate(db)
+        print(f"Версия схемы базы данных: {version}")
+
+# Путь к базе задаётся при запуске (set_db_path) или переменной окружения DB_PATH
+_db_path = None
+# Базы, для которых уже применены миграции в этом процессе
+_initialized_paths = set()
+
+def set_db_path(db_path: str):
+    """Выбор файла базы данных до первого обращения к ней"""
+    global _db_path
+    _db_path = db_path
+
+def get_db_path() -> str:
+    return _db_path or os.getenv('DB_PATH') or DEFAULT_DB_PATH
+
+# Пул долгоживущих соединений, общий для всех запросов
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or 4)
+_pool = None
+_pool_connections = []
+_pool_lock = asyncio.Lock()
+
+async def init_pool(db_path: str = None, size: int = DB_POOL_SIZE):
+    """Создание пула соединений. Вызывается при первом обращении к базе.
+    Перед открытием пула база один раз за процесс приводится к актуальной схеме."""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            return
+        db_path = db_path or get_db_path()
+        if db_path not in _initialized_paths:
+            await asyncio.to_thread(init_db, db_path)
+            _initialized_paths.add(db_path)
+        pool = asyncio.Queue()
+        for _ in range(size):
+            db = await aiosqlite.connect(db_path)
+            for pragma in DB_PRAGMAS:
+                await db.execute(pragma)
+            _pool_connections.append(db)
+            pool.put_nowait(db)
+        _pool = pool
+
+async def close_pool():
+    """Закрытие всех соединений пула при остановке приложения."""
+    global _pool
+    # Сначала дописываем принятые операции: им ещё нужны соединения пула
+    await write_queue.stop()
+    async with _pool_lock:
+        _pool = None
+        while _pool_connections:
+            db = _pool_connections.pop()
+            await db.close()
+
+@asynccontextmanager
+async def get_connection():
+    """Выдаёт соединение из пула на время запроса и возвращает его обратно."""
+    if _pool is None:
+        await init_pool()
+    pool = _pool
+    db = await pool.get()
+    try:
+        # Запросы дольше SLOW_QUERY_MS пишутся в лог с планом выполнения (query_log.py)
+        yield TracedConnection(db) if SLOW_QUERY_MS else db
+    finally:
+        # Незакоммиченные изменения не должны попасть к следующему запросу
+        if db.in_transaction:
+            await db.rollback()
+        pool.put_nowait(db)
+
+# Частые мелкие записи (регистрация, вступление в коробку, ответы участника)
+# коммитятся группами: одна транзакция на все записи, пришедшие за несколько миллисекунд
+write_queue = GroupCommitWriter(get_connection)
+# Через lambda, чтобы бенчмарк мог подменить write_queue
+add_gauges('santa_db_writes', lambda: write_queue.metrics())
+
+# Кэши редко меняющихся данных, которые читаются почти на каждое нажатие кнопки.
+# Функции записи ниже сбрасывают затронутые записи.
+CACHE_TTL = float(os.getenv('CACHE_TTL') or 60)
+CACHE_SIZE = int(os.getenv('CACHE_SIZE') or 10000)
+box_info_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+box_owner_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+participant_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+def cache_stats() -> dict:
+    """Счётчики попаданий и промахов кэшей"""
+    return {
+        'box_info': box_info_cache.stats(),
+        'box_owner': box_owner_cache.stats(),
+        'participant_info': participant_cache.stats()
+    }
+
+# Счётчики кэшей на странице метрик: santa_cache_<кэш>_{hits,misses,size}
+add_gauges('santa_cache', lambda: {
+    f'{name}_{key}': value for name, stats in cache_stats().items() for key, value in stats.items()
+})
+
+def invalidate_box(id_box: int):
+    """Сброс кэша всех записей, относящихся к коробке"""
+    box_info_cache.invalidate((id_box,))
+    box_owner_cache.invalidate_where(lambda key: key[1] == id_box)
+    participant_cache.invalidate_where(lambda key: key[1] == id_box)
 
 async def add_user(user_id: int, username: str, connection_date: str):
-    """Асинхронное добавление пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Добавление пользователя или обновление его username.
+    Дата подключения остаётся первой сохранённой."""
+    async def write(db):
         await db.execute("""
-        INSERT OR IGNORE INTO users (user_id, username, connection_date)
+        INSERT INTO users (user_id, username, connection_date)
         VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = excluded.username,
+            connection_date = COALESCE(users.connection_date, excluded.connection_date)
+        WHERE users.username IS NOT excluded.username OR users.connection_date IS NULL
         """, (user_id, username, connection_date))
-        await db.commit()
+    await write_queue.submit(write)
 
+async def iter_known_users(chunk_size: int = 10000):
+    """Все пользователи порциями строк (user_id, username) в порядке user_id"""
+    async with get_connection() as db:
+        async with db.execute("SELECT user_id, username FROM users ORDER BY user_id") as cursor:
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
 
-async def add_box(user_id: int, box_name: str, box_photo: str, box_desc: str) -> int:
-    """Асинхронное добавление коробки. Возвращает id созданной коробки."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
-        INSERT INTO santa_box (user_id, box_name, box_photo, box_desc)
-        VALUES (?, ?, ?, ?)
-        """, (user_id, box_name, box_photo, box_desc))
+
+async def add_box(user_id: int, box_name: str, box_photo: str, box_desc: str,
+                  box_photo_id: str = None, box_photo_unique_id: str = None) -> int:
+    """Асинхронное добавление коробки. Возвращает id созданной коробки.
+
+    box_photo - путь к локальной копии фото (может отсутствовать),
+    box_photo_id / box_photo_unique_id - file_id и file_unique_id фото в Telegram.
+    """
+    async with get_connection() as db:
+        async with db.execute("""
+        INSERT INTO santa_box (user_id, box_name, box_photo, box_desc, box_photo_id, box_photo_unique_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, box_name, box_photo, box_desc, box_photo_id, box_photo_unique_id)) as cursor:
+            box_id = cursor.lastrowid
         await db.commit()
-        return cursor.lastrowid  # озвращаем id созданной коробки
+    # Ранее мог быть закэширован отрицательный ответ для этого id
+    invalidate_box(box_id)
+    return box_id  # Возвращаем id созданной коробки
 
 async def delete_box(id_box: int):
-    """Удаление коробки и всех связанных записей"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Удаление коробки и всех связанных записей.
+    Возвращает путь к локальной копии фото коробки, если она была."""
+    async with get_connection() as db:
+        async with db.execute("SELECT box_photo FROM santa_box WHERE id_box = ?", (id_box,)) as cursor:
+            row = await cursor.fetchone()
         await db.execute("DELETE FROM santa_box WHERE id_box = ?", (id_box,))
         await db.execute("DELETE FROM santa_recipient WHERE id_box = ?", (id_box,))
         await db.execute("DELETE FROM user_wish WHERE id_box = ?", (id_box,))
+        await db.execute("DELETE FROM draw_exclusion WHERE id_box = ?", (id_box,))
+        await db.execute("DELETE FROM draw_household WHERE id_box = ?", (id_box,))
+        # Рассылки коробки: неотправленные больше не нужны, отправленные содержат адреса и пожелания
+        await db.execute("""
+            DELETE FROM outbox
+            WHERE id_batch IN (SELECT id_batch FROM outbox_batch WHERE id_box = ?)
+        """, (id_box,))
+        await db.execute("DELETE FROM outbox_batch WHERE id_box = ?", (id_box,))
         await db.commit()
+    invalidate_box(id_box)
+    return row[0] if row else None
 
 async def get_box_participants(id_box: int):
     """Получение списка участников коробки"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
-            SELECT DISTINCT uw.user_id, uw.user_name
+    async with get_connection() as db:
+        return await db.execute_fetchall("""
+            SELECT uw.user_id, uw.user_name
             FROM user_wish uw
             WHERE uw.id_box = ?
         """, (id_box,))
-        return await cursor.fetchall()
+
+async def get_box_participants_page(id_box: int, limit: int, after_id: int = None, before_id: int = None):
+    """Страница участников коробки в порядке вступления: строки (id записи, user_id, имя, username).
+    after_id/before_id - постраничная выборка по user_wish.id"""
+    condition, params, tail, reverse = keyset_page('uw.id', limit, after_id, before_id, descending=False)
+    async with get_connection() as db:
+        rows = await db.execute_fetchall(f"""
+            SELECT uw.id, uw.user_id, uw.user_name, u.username
+            FROM user_wish uw
+            LEFT JOIN users u ON u.user_id = uw.user_id
+            WHERE uw.id_box = ?{condition}{tail}
+        """, (id_box, *params))
+    return rows[::-1] if reverse else rows
+
+async def count_box_participants(id_box: int) -> int:
+    """Количество участников коробки"""
+    async with get_connection() as db:
+        async with db.execute("SELECT COUNT(*) FROM user_wish WHERE id_box = ?", (id_box,)) as cursor:
+            row = await cursor.fetchone()
+        return row[0]
+
+async def iter_participants_export(id_box: int, chunk_size: int = 1000):
+    """Участники коробки для выгрузки: порции строк (ID, username, имя, адрес, пожелание,
+    username получателя, имя получателя). Строки читаются курсором, весь список в память не загружается."""
+    async with get_connection() as db:
+        async with db.execute("""
+            SELECT uw.user_id, u.username, uw.user_name, uw.user_adds, uw.user_wish,
+                   r.username, rw.user_name
+            FROM user_wish uw
+            LEFT JOIN users u ON u.user_id = uw.user_id
+            LEFT JOIN santa_recipient sr ON sr.id_box = uw.id_box AND sr.santa_id = uw.user_id
+            LEFT JOIN users r ON r.user_id = sr.recipient_id
+            LEFT JOIN user_wish rw ON rw.id_box = uw.id_box AND rw.user_id = sr.recipient_id
+            WHERE uw.id_box = ?
+            ORDER BY uw.id
+        """, (id_box,)) as cursor:
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
 
 async def remove_participant(user_id: int, id_box: int):
     """Удаление участника из коробки"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with get_connection() as db:
         await db.execute("""
             DELETE FROM user_wish 
             WHERE user_id = ? AND id_box = ?
@@ -181,63 +414,214 @@ async def remove_participant(user_id: int, id_box: int):
             WHERE (santa_id = ? OR recipient_id = ?) AND id_box = ?
         """, (user_id, user_id, id_box))
         await db.commit()
+    participant_cache.invalidate((user_id, id_box))
 
+@cached(box_owner_cache)
 async def is_box_owner(user_id: int, id_box: int) -> bool:
     """Проверка является ли пользователь владельцем коробки"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    async with get_connection() as db:
+        async with db.execute("""
             SELECT 1 FROM santa_box 
             WHERE id_box = ? AND user_id = ?
-        """, (id_box, user_id))
-        return bool(await cursor.fetchone())
-
-async def create_santa_pairs(id_box: int):
-    """Создание пар Санта-Получатель"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получаем список участников
-        cursor = await db.execute("""
-            SELECT user_id FROM user_wish 
-            WHERE id_box = ?
-        """, (id_box,))
-        participants = [row[0] for row in await cursor.fetchall()]
-        
+        """, (id_box, user_id)) as cursor:
+            return bool(await cursor.fetchone())
+
+# Сколько коробок загружаем одним запросом при пакетной жеребьевке
+DRAW_BATCH_CHUNK = 500
+
+async def create_santa_pairs(id_box: int, seed=None, format_message=None, title: str = None, report_chat_id: int = None):
+    """Создание пар Санта-Получатель с учётом ограничений коробки.
+    seed делает жеребьевку воспроизводимой.
+
+    Если ограничения невыполнимы, выбрасывает draw.DrawUnsatisfiable. Возвращает список пар с данными Санты и получателя (username, имя, адрес,
+    пожелание), чтобы для рассылки не требовались дополнительные запросы.
+    Если передан format_message, уведомления Сантам (текст - format_message(пара))
+    ставятся в outbox в той же транзакции, что и пары.
+    """
+    async with get_connection() as db:
+        participants, forbidden, households = (await load_draw_data(db, [id_box]))[id_box]
         if len(participants) < 2:
             return None
         
-        # Перемешиваем список получателей
-        import random
-        recipients = participants.copy()
-        while True:
-            random.shuffle(recipients)
-            # Проверяем, что никто не дарит сам себе
-            if not any(s == r for s, r in zip(participants, recipients)):
-                break
-        
-        # Очищаем старые пары для этой коробки
-        await db.execute("""
-            DELETE FROM santa_recipient 
-            WHERE id_box = ?
-        """, (id_box,))
-        
-        # Создаем новые пары
-        pairs = list(zip(participants, recipients))
+        # Распределяем получателей с учётом ограничений коробки
+        drawn = solve(list(participants), forbidden, households, seed)
+        await save_draw(db, [id_box], [(santa, recipient, id_box) for santa, recipient in drawn])
+        pairs = make_pairs(participants, drawn)
+        if format_message:
+            await insert_messages(db, [(pair['santa_id'], format_message(pair)) for pair in pairs],
+                                  title, report_chat_id, id_box)
+        await db.commit()
+        return pairs
+
+async def create_santa_pairs_batch(box_ids, format_message, seed=None, title: str = None):
+    """Жеребьевка сразу в нескольких коробках на одном соединении и одной транзакцией.
+
+    Данные коробок загружаются общими запросами, пары всех коробок записываются
+    одним executemany. Уведомления Сантам (текст - format_message(пара)) ставятся
+    в outbox в той же транзакции, отдельным пакетом рассылки на каждую коробку:
+    прогресс рассылки получает организатор коробки. Коробки с невыполнимыми
+    ограничениями или меньше чем двумя участниками пропускаются.
+    Возвращает (результаты, id пакетов): результаты - словарь id_box -> число пар
+    или текст причины пропуска.
+    """
+    # Повторы id коробок дали бы две жеребьевки одной коробки в одной транзакции
+    box_ids = list(dict.fromkeys(box_ids))
+    results = {}
+    batches = []
+    async with get_connection() as db:
+        for start in range(0, len(box_ids), DRAW_BATCH_CHUNK):
+            chunk = box_ids[start:start + DRAW_BATCH_CHUNK]
+            draw_data = await load_draw_data(db, chunk)
+            placeholders = ", ".join("?" * len(chunk))
+            owners = dict(await db.execute_fetchall(
+                f"SELECT id_box, user_id FROM santa_box WHERE id_box IN ({placeholders})", chunk
+            ))
+            drawn_boxes, rows, messages = [], [], {}
+            for id_box in chunk:
+                participants, forbidden, households = draw_data[id_box]
+                if len(participants) < 2:
+                    results[id_box] = "недостаточно участников"
+                    continue
+                try:
+                    drawn = solve(list(participants), forbidden, households, seed)
+                except DrawUnsatisfiable as e:
+                    results[id_box] = str(e)
+                    continue
+                results[id_box] = len(drawn)
+                drawn_boxes.append(id_box)
+                rows.extend((santa, recipient, id_box) for santa, recipient in drawn)
+                messages[id_box] = [
+                    (pair['santa_id'], format_message(pair)) for pair in make_pairs(participants, drawn)
+                ]
+            await save_draw(db, drawn_boxes, rows)
+            for id_box, box_messages in messages.items():
+                batches.append(await insert_messages(db, box_messages, title, owners.get(id_box), id_box))
+        await db.commit()
+    return results, batches
+
+async def load_draw_data(db, box_ids):
+    """Загрузка участников и ограничений жеребьевки для нескольких коробок.
+    Возвращает словарь id_box -> (участники, запрещённые пары, домохозяйства)."""
+    placeholders = ", ".join("?" * len(box_ids))
+    draw_data = {id_box: ({}, set(), {}) for id_box in box_ids}
+    
+    # Участники вместе с данными пользователей
+    for id_box, user_id, username, name, address, wish in await db.execute_fetchall(f"""
+        SELECT uw.id_box, uw.user_id, u.username, uw.user_name, uw.user_adds, uw.user_wish
+        FROM user_wish uw
+        LEFT JOIN users u ON u.user_id = uw.user_id
+        WHERE uw.id_box IN ({placeholders})
+    """, box_ids):
+        draw_data[id_box][0][user_id] = {'username': username, 'name': name, 'address': address, 'wish': wish}
+    
+    # Запрещённые пары и пары жеребьевки из коробки прошлого года
+    for id_box, santa_id, recipient_id in await db.execute_fetchall(f"""
+        SELECT id_box, santa_id, recipient_id
+        FROM draw_exclusion
+        WHERE id_box IN ({placeholders})
+        UNION ALL
+        SELECT sb.id_box, sr.santa_id, sr.recipient_id
+        FROM santa_box sb
+        JOIN santa_recipient sr ON sr.id_box = sb.prev_box_id
+        WHERE sb.id_box IN ({placeholders})
+    """, (*box_ids, *box_ids)):
+        draw_data[id_box][1].add((santa_id, recipient_id))
+    
+    for id_box, user_id, household in await db.execute_fetchall(f"""
+        SELECT id_box, user_id, household
+        FROM draw_household
+        WHERE id_box IN ({placeholders})
+    """, box_ids):
+        draw_data[id_box][2][user_id] = household
+    return draw_data
+
+async def save_draw(db, box_ids, rows):
+    """Замена пар коробок box_ids новыми парами rows (santa_id, recipient_id, id_box) без фиксации транзакции"""
+    if not box_ids:
+        return
+    placeholders = ", ".join("?" * len(box_ids))
+    await db.execute(f"DELETE FROM santa_recipient WHERE id_box IN ({placeholders})", box_ids)
+    await db.executemany("""
+        INSERT INTO santa_recipient (santa_id, recipient_id, id_box)
+        VALUES (?, ?, ?)
+    """, rows)
+
+def make_pairs(participants: dict, drawn):
+    """Пары жеребьевки с данными Санты и получателя"""
+    pairs = []
+    for santa_id, recipient_id in drawn:
+        santa = participants[santa_id]
+        recipient = participants[recipient_id]
+        pairs.append({
+            'santa_id': santa_id,
+            'santa_username': santa['username'],
+            'santa_name': santa['name'],
+            'recipient_id': recipient_id,
+            'recipient_username': recipient['username'],
+            'recipient_name': recipient['name'],
+            'recipient_address': recipient['address'],
+            'recipient_wish': recipient['wish']
+        })
+    return pairs
+
+async def add_draw_exclusion(id_box: int, santa_id: int, recipient_id: int, mutual: bool = True):
+    """Запрет пары для жеребьевки. При mutual=True запрет действует в обе стороны."""
+    rows = [(id_box, santa_id, recipient_id)]
+    if mutual:
+        rows.append((id_box, recipient_id, santa_id))
+    async with get_connection() as db:
         await db.executemany("""
-            INSERT INTO santa_recipient (santa_id, recipient_id, id_box)
+            INSERT OR IGNORE INTO draw_exclusion (id_box, santa_id, recipient_id)
             VALUES (?, ?, ?)
-        """, [(santa, recipient, id_box) for santa, recipient in pairs])
-        
+        """, rows)
+        await db.commit()
+
+async def remove_draw_exclusion(id_box: int, santa_id: int, recipient_id: int, mutual: bool = True):
+    """Снятие запрета пары для жеребьевки"""
+    rows = [(id_box, santa_id, recipient_id)]
+    if mutual:
+        rows.append((id_box, recipient_id, santa_id))
+    async with get_connection() as db:
+        await db.executemany("""
+            DELETE FROM draw_exclusion
+            WHERE id_box = ? AND santa_id = ? AND recipient_id = ?
+        """, rows)
+        await db.commit()
+
+async def set_household(id_box: int, user_id: int, household: str = None):
+    """Назначение участнику домохозяйства (None - убрать из домохозяйства)"""
+    async with get_connection() as db:
+        if household is None:
+            await db.execute("""
+                DELETE FROM draw_household
+                WHERE id_box = ? AND user_id = ?
+            """, (id_box, user_id))
+        else:
+            await db.execute("""
+                INSERT OR REPLACE INTO draw_household (id_box, user_id, household)
+                VALUES (?, ?, ?)
+            """, (id_box, user_id, household))
+        await db.commit()
+
+async def set_previous_box(id_box: int, prev_box_id: int = None):
+    """Привязка коробки прошлого года, пары из которой не должны повториться"""
+    async with get_connection() as db:
+        await db.execute("""
+            UPDATE santa_box
+            SET prev_box_id = ?
+            WHERE id_box = ?
+        """, (prev_box_id, id_box))
         await db.commit()
-        return pairs
 
 async def get_user_info(user_id: int):
     """Получение информации о пользователе"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    async with get_connection() as db:
+        async with db.execute("""
             SELECT user_id, username, connection_date
             FROM users
             WHERE user_id = ?
-        """, (user_id,))
-        user_data = await cursor.fetchone()
+        """, (user_id,)) as cursor:
+            user_data = await cursor.fetchone()
         
         if user_data:
             return {
@@ -247,92 +631,168 @@ async def get_user_info(user_id: int):
             }
         return None
 
+@cached(box_info_cache)
 async def get_box_info(box_id: int):
     """Получение информации о коробке"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
-            SELECT id_box, box_name, box_desc, box_photo
+    async with get_connection() as db:
+        async with db.execute("""
+            SELECT id_box, box_name, box_desc, box_photo, box_photo_id, box_photo_unique_id
             FROM santa_box
             WHERE id_box = ?
-        """, (box_id,))
-        row = await cursor.fetchone()
+        """, (box_id,)) as cursor:
+            row = await cursor.fetchone()
         
         if row:
             return {
                 'id_box': row[0],
                 'box_name': row[1],
                 'box_desc': row[2],
-                'box_photo': row[3]
+                'box_photo': row[3],
+                'box_photo_id': row[4],
+                'box_photo_unique_id': row[5]
             }
         return None
 
+async def set_box_photo_id(box_id: int, box_photo_id: str, box_photo_unique_id: str):
+    """Сохранение file_id фото коробки после первой загрузки локальной копии в Telegram"""
+    async with get_connection() as db:
+        await db.execute("""
+            UPDATE santa_box
+            SET box_photo_id = ?, box_photo_unique_id = ?
+            WHERE id_box = ?
+        """, (box_photo_id, box_photo_unique_id, box_id))
+        await db.commit()
+    box_info_cache.invalidate((box_id,))
+
+async def find_photo_copy(box_photo_unique_id: str):
+    """Поиск уже сохранённой локальной копии фото по file_unique_id"""
+    async with get_connection() as db:
+        async with db.execute("""
+            SELECT box_photo
+            FROM santa_box
+            WHERE box_photo_unique_id = ? AND box_photo IS NOT NULL
+            LIMIT 1
+        """, (box_photo_unique_id,)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+async def count_photo_references(box_photo: str) -> int:
+    """Количество коробок, использующих локальный файл фото"""
+    async with get_connection() as db:
+        async with db.execute("SELECT COUNT(*) FROM santa_box WHERE box_photo = ?", (box_photo,)) as cursor:
+            row = await cursor.fetchone()
+        return row[0]
+
+async def get_photo_paths():
+    """Пути всех локальных файлов фото, на которые ссылаются коробки"""
+    async with get_connection() as db:
+        rows = await db.execute_fetchall("""
+            SELECT DISTINCT box_photo FROM santa_box WHERE box_photo IS NOT NULL
+        """)
+        return [row[0] for row in rows]
+
 async def is_participant(user_id: int, box_id: int) -> bool:
     """Проверка является ли пользователь участником коробки"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    async with get_connection() as db:
+        async with db.execute("""
             SELECT 1 FROM user_wish
             WHERE user_id = ? AND id_box = ?
-        """, (user_id, box_id))
-        return bool(await cursor.fetchone())
+        """, (user_id, box_id)) as cursor:
+            return bool(await cursor.fetchone())
 
 async def add_participant(user_id: int, name: str, address: str, box_id: int, wish: str):
     """Добавление участника в коробку"""
+    async def write(db):
+        await db.execute("""
+            INSERT INTO user_wish (user_id, user_name, user_adds, id_box, user_wish)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, name, address, box_id, wish))
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("""
-                INSERT INTO user_wish (user_id, user_name, user_adds, id_box, user_wish)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, name, address, box_id, wish))
-            await db.commit()
-            print(f"Участник добавлен: user_id={user_id}, box_id={box_id}")  # Для отладки
+        await write_queue.submit(write)
+        participant_cache.invalidate((user_id, box_id))
+        print(f"Участник добавлен: user_id={user_id}, box_id={box_id}")  # Для отладки
     except Exception as e:
         print(f"Ошибка при добавлении в базу данных: {e}")
         raise
 
 async def update_participant_info(user_id: int, box_id: int, field: str, value: str):
     """Обновление информации участника"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def write(db):
         await db.execute(f"""
             UPDATE user_wish
             SET {field} = ?
             WHERE user_id = ? AND id_box = ?
         """, (value, user_id, box_id))
-        await db.commit()
+    await write_queue.submit(write)
+    participant_cache.invalidate((user_id, box_id))
+
+def keyset_page(column: str, limit: int = None, after_id: int = None, before_id: int = None, descending: bool = True):
+    """Условие и сортировка для постраничной выборки по column (по умолчанию по убыванию).
+
+    after_id - следующая страница (записи после after_id в порядке сортировки),
+    before_id - предыдущая (записи до before_id). Предыдущая страница выбирается
+    в обратном порядке, поэтому вызывающий код разворачивает её, если возвращён
+    флаг reverse. Возвращает (условие, параметры, ORDER BY и LIMIT, reverse).
+    """
+    forward, backward = ("<", ">") if descending else (">", "<")
+    direction = "DESC" if descending else "ASC"
+    condition, params, reverse = "", [], False
+    if before_id is not None:
+        condition, reverse = f" AND {column} {backward} ?", True
+        direction = "ASC" if descending else "DESC"
+        params.append(before_id)
+    elif after_id is not None:
+        condition = f" AND {column} {forward} ?"
+        params.append(after_id)
+    tail = f" ORDER BY {column} {direction}"
+    if limit is not None:
+        tail += " LIMIT ?"
+        params.append(limit)
+    return condition, params, tail, reverse
+
+async def get_participating_boxes(user_id: int, limit: int = None, after_id: int = None, before_id: int = None):
+    """Получение списка коробок, в которых пользователь является участником,
+    от новых к старым. after_id/before_id - постраничная выборка по id_box"""
+    condition, params, tail, reverse = keyset_page('uw.id_box', limit, after_id, before_id)
+    async with get_connection() as db:
+        rows = await db.execute_fetchall(f"""
+            SELECT sb.id_box, sb.box_name, sb.box_desc
+            FROM user_wish uw
+            JOIN santa_box sb ON sb.id_box = uw.id_box
+            WHERE uw.user_id = ?{condition}{tail}
+        """, (user_id, *params))
+    if reverse:
+        rows = rows[::-1]
+    return [{'id_box': row[0], 'box_name': row[1], 'box_desc': row[2]} for row in rows]
 
-async def get_participating_boxes(user_id: int):
-    """Получение списка коробок, в которых пользователь является участником"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
-            SELECT DISTINCT sb.id_box, sb.box_name, sb.box_desc
-            FROM santa_box sb
-            JOIN user_wish uw ON sb.id_box = uw.id_box
-            WHERE uw.user_id = ?
-        """, (user_id,))
-        rows = await cursor.fetchall()
-        return [{'id_box': row[0], 'box_name': row[1], 'box_desc': row[2]} for row in rows]
-
-async def get_created_boxes(user_id: int):
-    """Получение списка коробок, созданных пользователем"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("""
+async def get_created_boxes(user_id: int, limit: int = None, after_id: int = None, before_id: int = None):
+    """Получение списка коробок, созданных пользователем, от новых к старым.
+    after_id/before_id - постраничная выборка по id_box"""
+    condition, params, tail, reverse = keyset_page('id_box', limit, after_id, before_id)
+    async with get_connection() as db:
+        # row_factory не меняем: соединение общее для всех запросов
+        rows = await db.execute_fetchall(f"""
             SELECT id_box, box_name, box_desc, box_photo
             FROM santa_box 
-            WHERE user_id = ?
-            ORDER BY id_box DESC
-        """, (user_id,))
-        boxes = await cursor.fetchall()
-        return [dict(row) for row in boxes] if boxes else []
+            WHERE user_id = ?{condition}{tail}
+        """, (user_id, *params))
+    if reverse:
+        rows = rows[::-1]
+    return [
+        {'id_box': row[0], 'box_name': row[1], 'box_desc': row[2], 'box_photo': row[3]}
+        for row in rows
+    ]
 
+@cached(participant_cache)
 async def get_participant_info(user_id: int, box_id: int):
     """Получение информации об участнике в конкретной коробке"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    async with get_connection() as db:
+        async with db.execute("""
             SELECT user_name, user_adds, user_wish
             FROM user_wish
             WHERE user_id = ? AND id_box = ?
-        """, (user_id, box_id))
-        row = await cursor.fetchone()
+        """, (user_id, box_id)) as cursor:
+            row = await cursor.fetchone()
         
         if row:
             return {
@@ -340,4 +800,169 @@ async def get_participant_info(user_id: int, box_id: int):
                 'user_adds': row[1],
                 'user_wish': row[2]
             }
-        return None
\ No newline at end of file
+        return None
+
+async def queue_messages(messages, title: str = None, report_chat_id: int = None, id_box: int = None) -> int:
+    """Постановка рассылки в очередь outbox. messages - список пар (chat_id, text).
+    id_box - коробка рассылки: при её удалении рассылка удаляется.
+    Возвращает id пакета рассылки."""
+    async with get_connection() as db:
+        id_batch = await insert_messages(db, messages, title, report_chat_id, id_box)
+        await db.commit()
+        return id_batch
+
+async def insert_messages(db, messages, title: str = None, report_chat_id: int = None, id_box: int = None) -> int:
+    """Запись пакета рассылки на переданном соединении без фиксации транзакции"""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    async with db.execute("""
+        INSERT INTO outbox_batch (title, report_chat_id, created_at, id_box)
+        VALUES (?, ?, ?, ?)
+    """, (title, report_chat_id, now, id_box)) as cursor:
+        id_batch = cursor.lastrowid
+    await db.executemany("""
+        INSERT INTO outbox (id_batch, chat_id, text, updated_at)
+        VALUES (?, ?, ?, ?)
+    """, [(id_batch, chat_id, text, now) for chat_id, text in messages])
+    return id_batch
+
+async def get_pending_messages(limit: int = 100):
+    """Получение очередной порции неотправленных сообщений в порядке постановки"""
+    async with get_connection() as db:
+        rows = await db.execute_fetchall("""
+            SELECT id, id_batch, chat_id, text
+            FROM outbox
+            WHERE status = 'pending'
+            ORDER BY id
+            LIMIT ?
+        """, (limit,))
+        return [
+            {'id': row[0], 'id_batch': row[1], 'chat_id': row[2], 'text': row[3]}
+            for row in rows
+        ]
+
+async def mark_messages(results):
+    """Сохранение результатов отправки. results - список пар (id сообщения, доставлено ли)."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    async with get_connection() as db:
+        await db.executemany("""
+            UPDATE outbox
+            SET status = ?, attempts = attempts + 1, updated_at = ?
+            WHERE id = ?
+        """, [('sent' if delivered else 'failed', now, message_id) for message_id, delivered in results])
+        await db.commit()
+
+async def get_batch_progress(id_batch: int):
+    """Получение состояния пакета рассылки: заголовок, чат организатора и счётчики по статусам"""
+    async with get_connection() as db:
+        async with db.execute("""
+            SELECT title, report_chat_id, report_message_id
+            FROM outbox_batch
+            WHERE id_batch = ?
+        """, (id_batch,)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        counts = dict(await db.execute_fetchall("""
+            SELECT status, COUNT(*)
+            FROM outbox
+            WHERE id_batch = ?
+            GROUP BY status
+        """, (id_batch,)))
+        return {
+            'id_batch': id_batch,
+            'title': row[0],
+            'report_chat_id': row[1],
+            'report_message_id': row[2],
+            'pending': counts.get('pending', 0),
+            'sent': counts.get('sent', 0),
+            'failed': counts.get('failed', 0),
+            'total': sum(counts.values())
+        }
+
+async def purge_outbox(before: str) -> int:
+    """Удаление отправленных и недоставленных сообщений, завершённых до before,
+    и опустевших пакетов рассылки. Возвращает число удалённых сообщений."""
+    async with get_connection() as db:
+        async with db.execute("""
+            DELETE FROM outbox WHERE status != 'pending' AND updated_at < ?
+        """, (before,)) as cursor:
+            removed = cursor.rowcount
+        await db.execute("""
+            DELETE FROM outbox_batch
+            WHERE created_at < ?
+              AND NOT EXISTS (SELECT 1 FROM outbox o WHERE o.id_batch = outbox_batch.id_batch)
+        """, (before,))
+        await db.commit()
+        return removed
+
+async def set_batch_report_message(id_batch: int, message_id: int):
+    """Сохранение id сообщения с прогрессом рассылки, чтобы после перезапуска продолжить его обновлять"""
+    async with get_connection() as db:
+        await db.execute("""
+            UPDATE outbox_batch
+            SET report_message_id = ?
+            WHERE id_batch = ?
+        """, (message_id, id_batch))
+        await db.commit()
+
+async def load_persistent_user_data(since: str):
+    """user_data пользователей, активных после since: пары (user_id, JSON)"""
+    async with get_connection() as db:
+        return await db.execute_fetchall("""
+            SELECT user_id, data
+            FROM persistent_user_data
+            WHERE updated_at >= ?
+        """, (since,))
+
+async def load_persistent_conversations(name: str, since: str):
+    """Состояния диалога name, изменённые после since: пары (ключ JSON, состояние JSON)"""
+    async with get_connection() as db:
+        return await db.execute_fetchall("""
+            SELECT key, state
+            FROM persistent_conversation
+            WHERE name = ? AND updated_at >= ?
+        """, (name, since))
+
+async def save_persistent_data(user_rows, conversation_rows):
+    """Сохранение накопленных изменений одной транзакцией.
+    user_rows - пары (user_id, JSON или None для удаления),
+    conversation_rows - тройки (имя диалога, ключ JSON, состояние JSON или None для удаления)."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    async with get_connection() as db:
+        await db.executemany("""
+            INSERT INTO persistent_user_data (user_id, data, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        """, [(user_id, data, now) for user_id, data in user_rows if data is not None])
+        await db.executemany(
+            "DELETE FROM persistent_user_data WHERE user_id = ?",
+            [(user_id,) for user_id, data in user_rows if data is None]
+        )
+        await db.executemany("""
+            INSERT INTO persistent_conversation (name, key, state, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (name, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        """, [(name, key, state, now) for name, key, state in conversation_rows if state is not None])
+        await db.executemany(
+            "DELETE FROM persistent_conversation WHERE name = ? AND key = ?",
+            [(name, key) for name, key, state in conversation_rows if state is None]
+        )
+        await db.commit()
+
+async def evict_persistent_data(before: str):
+    """Удаление user_data и состояний диалогов, не менявшихся с before.
+    Возвращает (id пользователей, пары (имя диалога, ключ)) удалённых записей."""
+    async with get_connection() as db:
+        rows = await db.execute_fetchall(
+            "SELECT user_id FROM persistent_user_data WHERE updated_at < ?", (before,)
+        )
+        conversations = await db.execute_fetchall(
+            "SELECT name, key FROM persistent_conversation WHERE updated_at < ?", (before,)
+        )
+        await db.execute("DELETE FROM persistent_user_data WHERE updated_at < ?", (before,))
+        await db.execute("DELETE FROM persistent_conversation WHERE updated_at < ?", (before,))
+        await db.commit()
+        return [row[0] for row in rows], [(name, key) for name, key in conversations]
+
+# Время выполнения, ошибки и число выполняющихся вызовов каждой функции модуля (metrics.py)
+instrument_module(globals(), 'db')
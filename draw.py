@@ -0,0 +1,173 @@
+import random
+
+
+def make_rng(seed=None) -> random.Random:
+    """Генератор случайных чисел для жеребьевки. С seed результат воспроизводим."""
+    return random.Random(seed)
+
+
+def single_cycle(participants, seed=None) -> list:
+    """Распределение получателей одним случайным циклом (алгоритм Саттоло).
+
+    Работает за O(n) и без повторных попыток: в цикле длины n >= 2 никто не
+    дарит подарок сам себе. Каждый из (n-1)! циклов выпадает с равной
+    вероятностью. Возвращает список пар (санта, получатель) в порядке participants.
+    """
+    santas = list(participants)
+    if len(santas) < 2:
+        return []
+    rng = make_rng(seed)
+    recipients = santas.copy()
+    # Перемешивание Саттоло: j выбирается строго меньше i, поэтому перестановка
+    # получается одним циклом и ни один элемент не остаётся на своём месте
+    for i in range(len(recipients) - 1, 0, -1):
+        j = int(rng.random() * i)
+        recipients[i], recipients[j] = recipients[j], recipients[i]
+    return list(zip(santas, recipients))
+
+
+class DrawUnsatisfiable(Exception):
+    """Ограничения не позволяют подобрать получателя каждому участнику"""
+
+    def __init__(self, message: str, participant=None):
+        super().__init__(message)
+        self.participant = participant
+
+
+def solve(participants, forbidden=(), households=None, seed=None) -> list:
+    """Жеребьевка с ограничениями.
+
+    forbidden - пары (санта, получатель), которые нельзя составлять
+    (исключения организатора, пары прошлого года). households - словарь
+    {участник: домохозяйство}: участники одного домохозяйства не дарят друг другу.
+
+    Начинаем со случайного цикла single_cycle и переназначаем только нарушивших
+    ограничения Сант, ища увеличивающие пути в двудольном графе "санта - получатель"
+    (алгоритм Куна, поиск в ширину). Если путь не найден, полного назначения не
+    существует, и сразу выбрасывается DrawUnsatisfiable.
+    """
+    santas = list(participants)
+    if len(santas) < 2:
+        return []
+    households = households or {}
+    members = set(santas)
+    forbidden_by_santa = {}
+    for santa, recipient in forbidden:
+        if santa in members and recipient in members and santa != recipient:
+            forbidden_by_santa.setdefault(santa, set()).add(recipient)
+    household_of = {user: households[user] for user in santas if households.get(user) is not None}
+
+    if not forbidden_by_santa and not household_of:
+        return single_cycle(santas, seed)
+
+    def allowed(santa, recipient) -> bool:
+        if santa == recipient:
+            return False
+        household = household_of.get(santa)
+        if household is not None and household == household_of.get(recipient):
+            return False
+        excluded = forbidden_by_santa.get(santa)
+        return not excluded or recipient not in excluded
+
+    _check_quick(santas, forbidden_by_santa, household_of)
+
+    rng = make_rng(seed)
+    match = dict(single_cycle(santas, rng.random()))
+    owner = {recipient: santa for santa, recipient in match.items()}
+
+    # Снимаем нарушающие ограничения назначения
+    free_santas = []
+    free_recipients = []
+    for santa in santas:
+        recipient = match[santa]
+        if not allowed(santa, recipient):
+            del match[santa]
+            del owner[recipient]
+            free_santas.append(santa)
+            free_recipients.append(recipient)
+    rng.shuffle(free_santas)
+
+    candidates = santas.copy()
+    rng.shuffle(candidates)
+    for santa in free_santas:
+        if not _augment(santa, match, owner, free_recipients, candidates, allowed, rng):
+            raise DrawUnsatisfiable(
+                "Невозможно провести жеребьевку: ограничения не позволяют подобрать "
+                f"получателя для участника {santa}",
+                participant=santa
+            )
+
+    return [(santa, match[santa]) for santa in santas]
+
+
+def _check_quick(santas, forbidden_by_santa, household_of):
+    """Быстрые проверки выполнимости, чтобы не запускать поиск на заведомо невыполнимых ограничениях"""
+    total = len(santas)
+    household_sizes = {}
+    for household in household_of.values():
+        household_sizes[household] = household_sizes.get(household, 0) + 1
+
+    # Условие Холла для домохозяйства: его участники дарят только тем, кто вне его
+    for household, size in household_sizes.items():
+        if size > total - size:
+            raise DrawUnsatisfiable(
+                f"Невозможно провести жеребьевку: в группе «{household}» {size} из {total} участников"
+            )
+
+    # У каждого Санты должен остаться хотя бы один возможный получатель
+    for santa, excluded in forbidden_by_santa.items():
+        household = household_of.get(santa)
+        same_household = household_sizes.get(household, 1) if household is not None else 1
+        excluded_outside = sum(
+            1 for recipient in excluded
+            if household is None or household_of.get(recipient) != household
+        )
+        if total - same_household - excluded_outside <= 0:
+            raise DrawUnsatisfiable(
+                f"Невозможно провести жеребьевку: участнику {santa} некому дарить подарок",
+                participant=santa
+            )
+
+
+def _augment(start, match, owner, free_recipients, candidates, allowed, rng) -> bool:
+    """Поиск в ширину увеличивающего пути от свободного Санты.
+
+    Сначала пробуем свободных получателей напрямую, затем переназначаем
+    уже занятых по цепочке. При успехе обновляет match/owner на месте.
+    """
+    parent = {start: None}
+    visited = set()
+    queue = [start]
+    for santa in queue:
+        # Свободный получатель: путь найден
+        offset = int(rng.random() * len(free_recipients))
+        for k in range(len(free_recipients)):
+            index = (offset + k) % len(free_recipients)
+            recipient = free_recipients[index]
+            if allowed(santa, recipient):
+                free_recipients[index] = free_recipients[-1]
+                free_recipients.pop()
+                _apply_path(santa, recipient, parent, match, owner)
+                return True
+        # Занятый получатель: его текущий Санта должен найти себе другого
+        for recipient in candidates:
+            if recipient in visited or recipient not in owner or not allowed(santa, recipient):
+                continue
+            visited.add(recipient)
+            holder = owner[recipient]
+            if holder not in parent:
+                parent[holder] = (santa, recipient)
+                queue.append(holder)
+    return False
+
+
+def _apply_path(santa, recipient, parent, match, owner):
+    """Переназначение получателей вдоль найденного пути"""
+    while True:
+        match[santa] = recipient
+        owner[recipient] = santa
+        link = parent[santa]
+        if link is None:
+            return
+        # Предыдущий Санта в цепочке забирает получателя, освобождённого текущим
+        santa, recipient = link
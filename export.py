@@ -0,0 +1,100 @@
+import asyncio
+import csv
+import io
+import os
+from importlib.util import find_spec
+from tempfile import SpooledTemporaryFile
+from database import iter_participants_export
+
+# Сколько строк читаем из базы и записываем в файл за один шаг
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE') or 1000)
+# Файл выгрузки держится в памяти, пока не превысит этот размер, затем переносится на диск
+EXPORT_SPOOL_SIZE = int(os.getenv('EXPORT_SPOOL_SIZE') or 1024 * 1024)
+
+EXPORT_COLUMNS = ['ID', 'Username', 'Имя', 'Адрес', 'Пожелание', 'Получатель', 'Имя получателя']
+# XLSX - необязательная возможность: без openpyxl доступна только выгрузка в CSV.
+# Сам openpyxl импортируется при первой выгрузке, чтобы не замедлять запуск бота
+XLSX_AVAILABLE = find_spec('openpyxl') is not None
+# Текст, начинающийся с этих символов, Excel считает формулой
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_formula(value):
+    """Экранирование текста участника, который Excel принял бы за формулу"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class CsvExportWriter:
+    """Запись выгрузки в CSV. BOM нужен, чтобы Excel открыл кириллицу без перекодировки."""
+
+    def __init__(self, file):
+        self._text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(EXPORT_COLUMNS)
+
+    def write_rows(self, rows):
+        self._writer.writerows([escape_formula(value) for value in row] for row in rows)
+
+    def close(self):
+        self._text.flush()
+        # Файл остаётся открытым: его отправляет вызывающий код
+        self._text.detach()
+
+
+class XlsxExportWriter:
+    """Запись выгрузки в XLSX в потоковом режиме openpyxl (write_only)"""
+
+    def __init__(self, file):
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        self._illegal = ILLEGAL_CHARACTERS_RE
+        self._file = file
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet('Участники')
+        self._sheet.append(EXPORT_COLUMNS)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._sheet.append([self._clean(value) for value in row])
+
+    def _clean(self, value):
+        # Управляющие символы openpyxl не записывает и падает на всей выгрузке
+        if isinstance(value, str):
+            value = self._illegal.sub('', value)
+        return escape_formula(value)
+
+    def close(self):
+        self._workbook.save(self._file)
+
+
+EXPORT_FORMATS = {
+    'csv': CsvExportWriter,
+    'xlsx': XlsxExportWriter,
+}
+
+
+async def export_participants(id_box: int, fmt: str = 'csv') -> SpooledTemporaryFile:
+    """Выгрузка участников коробки в файл формата fmt.
+
+    Строки читаются из базы порциями и сразу пишутся в файл, а запись
+    выполняется в отдельном потоке, чтобы не задерживать других пользователей.
+    Возвращает файл, установленный на начало; закрывает его вызывающий код.
+    """
+    if fmt == 'xlsx' and not XLSX_AVAILABLE:
+        raise ValueError("Выгрузка в XLSX недоступна: не установлен openpyxl")
+    writer_class = EXPORT_FORMATS[fmt]
+
+    file = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        writer = await asyncio.to_thread(writer_class, file)
+        async for rows in iter_participants_export(id_box, EXPORT_CHUNK_SIZE):
+            await asyncio.to_thread(writer.write_rows, rows)
+        await asyncio.to_thread(writer.close)
+        file.seek(0)
+        return file
+    except BaseException:
+        file.close()
+        raise
@@ -0,0 +1,150 @@
+import asyncio
+import os
+
+# Сколько миллисекунд после первой записи ждём следующие, чтобы закоммитить их вместе.
+# 0 - без ожидания: в транзакцию попадают только записи, накопившиеся во время прошлого коммита
+WRITE_BATCH_WINDOW = float(os.getenv('WRITE_BATCH_MS') or 2) / 1000
+# Наибольшее число операций в одной транзакции
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE') or 256)
+# Режим synchronous на время групповой транзакции. FULL: в режиме WAL коммит ждёт fsync,
+# и вызывающий получает результат, только когда запись переживёт отключение питания.
+# Соединения пула работают с NORMAL, на время транзакции режим переключается
+WRITE_SYNCHRONOUS = os.getenv('WRITE_SYNCHRONOUS') or 'FULL'
+
+
+class GroupCommitWriter:
+    """Единственный писатель с очередью операций и групповым коммитом.
+
+    Операция - асинхронная функция от соединения, выполняющая свои запросы без
+    commit. Операции, пришедшие в пределах окна, выполняются в одной транзакции.
+    Если одна из них падает, транзакция откатывается и повторяется с точкой
+    сохранения (SAVEPOINT) на каждую операцию: ошибка откатывает только свою
+    операцию и передаётся её вызывающему, остальные коммитятся. Поэтому операция
+    не должна иметь побочных эффектов вне базы. Вызывающий получает результат
+    только после коммита транзакции, записанного на диск (synchronous, по
+    умолчанию FULL): fsync один на всю группу, а не на каждую операцию.
+
+    Задача записи запускается при первой операции. Операция, вызывающий которой
+    был отменён до начала её выполнения, пропускается.
+    """
+
+    def __init__(self, connect, window: float = WRITE_BATCH_WINDOW, max_batch: int = WRITE_BATCH_SIZE,
+                 synchronous: str = WRITE_SYNCHRONOUS):
+        # connect() - асинхронный контекстный менеджер, выдающий соединение
+        self.connect = connect
+        self.window = window
+        self.max_batch = max_batch
+        self.synchronous = synchronous
+        self.batches = 0
+        self.operations = 0
+        self.max_batch_seen = 0
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+    async def submit(self, operation):
+        """Выполнение операции в очередной групповой транзакции. Возвращает результат операции."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            # Своя очередь у каждой задачи записи: после stop() старая задача дописывает свою
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(self._queue))
+        future = loop.create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def stop(self):
+        """Запись всех принятых операций и остановка задачи записи"""
+        task, self._task = self._task, None
+        if task is None or task.done() or self._loop is not asyncio.get_running_loop():
+            return
+        self._queue.put_nowait(None)
+        await task
+
+    def metrics(self) -> dict:
+        return {
+            'batches': self.batches,
+            'operations': self.operations,
+            'max_batch_seen': self.max_batch_seen,
+            'queue_size': self._queue.qsize() if self._queue else 0,
+        }
+
+    async def _run(self, queue):
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is None:
+                break
+            batch = [item]
+            if self.window and queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        batch = [(operation, future) for operation, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        try:
+            async with self.connect() as db:
+                async with db.execute("PRAGMA synchronous") as cursor:
+                    previous = (await cursor.fetchone())[0]
+                await db.execute(f"PRAGMA synchronous = {self.synchronous}")
+                try:
+                    results = await self._execute(db, batch, isolated=False)
+                    if results is None:
+                        # Одна из операций упала: откатываем всё и повторяем с точками сохранения
+                        await db.rollback()
+                        results = await self._execute(db, batch, isolated=True)
+                    await db.commit()
+                finally:
+                    if db.in_transaction:
+                        await db.rollback()
+                    # Соединение возвращается в пул с прежним режимом
+                    await db.execute(f"PRAGMA synchronous = {previous}")
+        except Exception as e:
+            # Транзакция не закоммичена (соединение откатывает её при возврате в пул)
+            print(f"Ошибка групповой записи ({len(batch)} операций): {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.operations += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _execute(self, db, batch, isolated: bool):
+        """Выполнение операций в одной транзакции. Без isolated точки сохранения не
+        ставятся (лишние запросы на каждую операцию), и при первой ошибке возвращается None."""
+        # IMMEDIATE: блокировка записи берётся сразу, а не при первом изменении
+        await db.execute("BEGIN IMMEDIATE")
+        results = []
+        for operation, future in batch:
+            if not isolated:
+                try:
+                    results.append((future, await operation(db), None))
+                except Exception:
+                    return None
+                continue
+            await db.execute("SAVEPOINT write_operation")
+            try:
+                results.append((future, await operation(db), None))
+            except Exception as e:
+                await db.execute("ROLLBACK TO write_operation")
+                results.append((future, None, e))
+            await db.execute("RELEASE write_operation")
+        return results
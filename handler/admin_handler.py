@@ -0,0 +1,51 @@
+import os
+from telegram import Update
+from telegram.ext import ContextTypes
+from database import create_santa_pairs_batch
+from broadcast import outbox_worker
+from handler.box_management_handler import format_draw_message
+
+# Telegram id администраторов бота через запятую
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+# Сколько коробок показываем в отчёте о пропущенных
+SKIPPED_REPORT_LIMIT = 20
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_IDS
+
+async def batch_draw(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пакетная жеребьевка: /batch_draw id коробки [id коробки ...].
+    Коробки перечисляются явно: жеребьевка без ведома организатора, который ещё
+    собирает участников, недопустима. Прогресс рассылки по каждой коробке
+    получает её организатор, администратор - итоговый отчёт."""
+    if not is_admin(update.effective_user.id):
+        return
+
+    try:
+        box_ids = [int(arg) for arg in context.args]
+    except ValueError:
+        box_ids = []
+    if not box_ids:
+        await update.message.reply_text("Использование: /batch_draw id коробки [id коробки ...]")
+        return
+
+    results, batches = await create_santa_pairs_batch(
+        box_ids,
+        format_draw_message,
+        title="Рассылка результатов жеребьевки"
+    )
+    if batches:
+        outbox_worker.wake()
+
+    drawn = {id_box: count for id_box, count in results.items() if isinstance(count, int)}
+    skipped = {id_box: reason for id_box, reason in results.items() if not isinstance(reason, int)}
+    lines = [
+        f"✨ Жеребьевка проведена в коробках: {len(drawn)}",
+        f"Пар создано: {sum(drawn.values())}"
+    ]
+    if skipped:
+        lines.append(f"\nПропущено коробок: {len(skipped)}")
+        lines.extend(
+            f"- {id_box}: {reason}" for id_box, reason in list(skipped.items())[:SKIPPED_REPORT_LIMIT]
+        )
+    await update.message.reply_text("\n".join(lines))
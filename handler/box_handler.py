@@ -1,35 +1,15 @@
-from database import add_box
+from database import add_box, set_box_photo_id
+from photo_store import find_photo, read_photo, save_photo
 from telegram import Update, ReplyKeyboardRemove, ReplyKeyboardMarkup
-from telegram.ext import (
-    ContextTypes,
-    ConversationHandler,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
-    filters
-)
-from .box_management_handler import (
-    show_box_menu,
-    return_to_main_menu,
-    show_participants,
-    download_participants,
-    start_santa_draw,
-    notify_participants,
-    send_notification
-)
+from telegram.ext import ContextTypes, ConversationHandler
 import os
-from datetime import datetime
 
 # Определяем состояния
 NAME, PHOTO, DESCRIPTION = range(3)
-WAITING_FOR_NOTIFICATION_TEXT = "WAITING_FOR_NOTIFICATION_TEXT"
 
-# Создаем константу для пути к папке с фотографиями
-PHOTO_DIR = "photo_box"
-
-# Создаем папку, если её нет
-if not os.path.exists(PHOTO_DIR):
-    os.makedirs(PHOTO_DIR)
+# Хранить ли локальные копии фото. Фото показываются по file_id Telegram,
+# поэтому копия нужна только как резерв.
+KEEP_PHOTO_FILES = os.getenv("KEEP_PHOTO_FILES", "0") == "1"
 
 async def create_box(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начало создания коробки"""
@@ -76,19 +56,45 @@ async def get_box_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     )
     return PHOTO
 
+async def send_box_photo(message, box_info: dict, caption: str, **kwargs) -> bool:
+    """Отправка фото коробки в ответ на сообщение.
+
+    Фото отправляется по file_id без повторной загрузки. Для старых коробок,
+    у которых есть только локальный файл, он загружается один раз, а полученный
+    file_id сохраняется. Возвращает False, если у коробки нет фото.
+    """
+    if box_info.get('box_photo_id'):
+        await message.reply_photo(photo=box_info['box_photo_id'], caption=caption, **kwargs)
+        return True
+
+    data = await read_photo(box_info.get('box_photo'))
+    if data is None:
+        return False
+
+    sent = await message.reply_photo(photo=data, caption=caption, **kwargs)
+    photo = sent.photo[-1]
+    if box_info.get('id_box'):
+        await set_box_photo_id(box_info['id_box'], photo.file_id, photo.file_unique_id)
+    return True
+
 async def get_box_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Получаем фото коробки"""
-    photo_file = await update.message.photo[-1].get_file()
-    
-    # Создаем уникальное имя файла используя timestamp
-    file_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{update.effective_user.id}.jpg"
-    file_path = os.path.join(PHOTO_DIR, file_name)
+    photo = update.message.photo[-1]
     
-    # Скачиваем и сохраняем фото
-    await photo_file.download_to_drive(file_path)
+    # Для показа достаточно file_id: Telegram хранит фото у себя
+    context.user_data['box_photo_id'] = photo.file_id
+    context.user_data['box_photo_unique_id'] = photo.file_unique_id
+    context.user_data['box_photo'] = None
     
-    # Сохраняем путь к фото в контексте
-    context.user_data['box_photo'] = file_path
+    if KEEP_PHOTO_FILES:
+        # Одинаковое фото (тот же file_unique_id) не скачиваем повторно
+        file_path = await find_photo(photo.file_unique_id)
+        if not file_path:
+            photo_file = await photo.get_file()
+            data = await photo_file.download_as_bytearray()
+            # Имя файла - хэш содержимого, поэтому одинаковые фото хранятся один раз
+            file_path = await save_photo(bytes(data))
+        context.user_data['box_photo'] = file_path
     
     await update.message.reply_text(
         "Фото успешно сохранено! Теперь введите описание коробки:"
@@ -98,6 +104,8 @@ async def get_box_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 async def skip_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Пропуск добавления фото"""
     context.user_data['box_photo'] = None
+    context.user_data['box_photo_id'] = None
+    context.user_data['box_photo_unique_id'] = None
     await update.message.reply_text(
         "📝 *Хорошо!* Фото пропущено.\n\n"
         "Теперь добавьте описание коробки:\n"
@@ -127,7 +135,9 @@ async def get_description(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user_id=user_id,
         box_name=context.user_data['box_name'],
         box_photo=context.user_data['box_photo'],
-        box_desc=context.user_data['box_description']
+        box_desc=context.user_data['box_description'],
+        box_photo_id=context.user_data.get('box_photo_id'),
+        box_photo_unique_id=context.user_data.get('box_photo_unique_id')
     )
     
     # Сохраняем id коробки в context.user_data
@@ -140,59 +150,23 @@ async def get_description(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
     # Отправляем сообщение с фото
-    if context.user_data['box_photo'] and os.path.exists(context.user_data['box_photo']):
-        with open(context.user_data['box_photo'], 'rb') as photo:
-            await update.message.reply_photo(
-                photo=photo,
-                caption=(
-                    "✅ <b>Коробка успешно создана!</b>\n\n"
-                    f"<b>Название:</b> {context.user_data['box_name']}\n"
-                    f"<b>ID коробки:</b> <code>{box_id}</code>\n"
-                    f"<b>Описание:</b>\n<blockquote>{context.user_data['box_description']}</blockquote>\n\n"
-                    "🎯 <b>Используйте пункт настройки из главного меню</b> \n"
-                ),
-                parse_mode='HTML',
-                reply_markup=reply_markup
-            )
-    else:
+    box_info = {
+        'id_box': box_id,
+        'box_photo': context.user_data['box_photo'],
+        'box_photo_id': context.user_data.get('box_photo_id')
+    }
+    caption = (
+        "✅ <b>Коробка успешно создана!</b>\n\n"
+        f"<b>Название:</b> {context.user_data['box_name']}\n"
+        f"<b>ID коробки:</b> <code>{box_id}</code>\n"
+        f"<b>Описание:</b>\n<blockquote>{context.user_data['box_description']}</blockquote>\n\n"
+        "🎯 <b>Используйте пункт настройки из главного меню</b>\n"
+    )
+    if not await send_box_photo(update.message, box_info, caption, parse_mode='HTML', reply_markup=reply_markup):
         await update.message.reply_text(
-            "✅ <b>Коробка успешно создана!</b>\n\n"
-            f"<b>Название:</b> {context.user_data['box_name']}\n"
-            f"<b>ID коробки:</b> <code>{box_id}</code>\n"
-            f"<b>Описание:</b>\n<blockquote>{context.user_data['box_description']}</blockquote>\n\n"
-            "🎯 <b>Используйте пункт настройки из главного меню</b>\n",
+            caption,
             parse_mode='HTML',
             reply_markup=reply_markup
         )
     
     return ConversationHandler.END
-
-# Добавьте этот обработчик в основной файл
-box_conv_handler = ConversationHandler(
-    entry_points=[MessageHandler(filters.Regex('^Создать коробку$'), create_box)],
-    states={
-        NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_box_name)],
-        PHOTO: [
-            MessageHandler(filters.PHOTO, get_box_photo),
-            CommandHandler('skip', skip_photo)
-        ],
-        DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_description)],
-    },
-    fallbacks=[]
-)
-
-box_management_handler = ConversationHandler(
-    entry_points=[MessageHandler(filters.Regex('^Управление коробкой$'), show_box_menu)],
-    states={
-        WAITING_FOR_NOTIFICATION_TEXT: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, send_notification)
-        ],
-    },
-    fallbacks=[
-        MessageHandler(filters.Regex('^Вернуться в меню$'), return_to_main_menu),
-        MessageHandler(filters.Regex('^Список участников$'), show_participants),
-        MessageHandler(filters.Regex('^Скачать список участников$'), download_participants),
-        MessageHandler(filters.Regex('^Провести жеребьевку$'), start_santa_draw),
-        MessageHandler(filters.Regex('^Уведомить участников$'), notify_participants),
-    ]
-)
\ No newline at end of file
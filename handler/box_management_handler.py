@@ -1,16 +1,21 @@
-import csv
-import io
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
+import asyncio
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
 from database import (
     delete_box, 
     get_box_participants, 
+    get_box_participants_page,
+    count_box_participants,
     remove_participant, 
     create_santa_pairs,
     is_box_owner,
-    get_user_info,
     get_box_info
 )
+from broadcast import outbox_worker, queue_broadcast
+from export import export_participants, XLSX_AVAILABLE
+from photo_store import release_photo
+from draw import DrawUnsatisfiable
 
 WAITING_FOR_NOTIFICATION_TEXT = "WAITING_FOR_NOTIFICATION_TEXT"
 MANAGE_BOX = 'MANAGE_BOX'
@@ -24,6 +29,7 @@ async def show_box_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [KeyboardButton("Список участников")],
         [KeyboardButton("Скачать список участников")],
+        [KeyboardButton("Скачать список участников (XLSX)")],
         [KeyboardButton("Провести жеребьевку")],
         [KeyboardButton("Уведомить участников")],
         [KeyboardButton("Удалить коробку")],
@@ -72,35 +78,136 @@ async def return_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     return ConversationHandler.END
 
+# Сколько участников показываем на одной странице. Имя обрезается до PARTICIPANT_NAME_LIMIT
+# символов, поэтому страница заведомо укладывается в лимит Telegram 4096 символов
+PARTICIPANTS_PAGE_SIZE = 30
+PARTICIPANT_NAME_LIMIT = 64
+# Префикс callback_data кнопок листания: participants:<id_box>:<next|prev>:<id записи>
+PARTICIPANTS_PAGE_PREFIX = 'participants'
+
+def format_participant(user_name: str, username: str) -> str:
+    """Строка участника в списке"""
+    name = user_name or "Без имени"
+    if len(name) > PARTICIPANT_NAME_LIMIT:
+        name = name[:PARTICIPANT_NAME_LIMIT - 1] + "…"
+    return f"- {name} (@{username})" if username else f"- {name}"
+
+async def build_participants_page(id_box: int, after_id: int = None, before_id: int = None):
+    """Текст и клавиатура одной страницы списка участников. None, если на странице никого нет"""
+    # Одна лишняя запись показывает, есть ли страница дальше в направлении листания
+    rows = await get_box_participants_page(id_box, PARTICIPANTS_PAGE_SIZE + 1, after_id, before_id)
+    if not rows:
+        return None
+    
+    has_more = len(rows) > PARTICIPANTS_PAGE_SIZE
+    if before_id is not None:
+        rows = rows[-PARTICIPANTS_PAGE_SIZE:]
+        has_prev, has_next = has_more, True
+    else:
+        rows = rows[:PARTICIPANTS_PAGE_SIZE]
+        has_prev, has_next = after_id is not None, has_more
+    
+    total = await count_box_participants(id_box)
+    lines = [f"Список участников (всего {total}):"]
+    lines.extend(format_participant(user_name, username) for _, _, user_name, username in rows)
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Назад", callback_data=f"{PARTICIPANTS_PAGE_PREFIX}:{id_box}:prev:{rows[0][0]}"
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            "Далее ➡️", callback_data=f"{PARTICIPANTS_PAGE_PREFIX}:{id_box}:next:{rows[-1][0]}"
+        ))
+    reply_markup = InlineKeyboardMarkup([navigation]) if navigation else None
+    return "\n".join(lines), reply_markup
+
 async def show_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать список участников"""
     id_box = context.user_data.get('current_box_id')
-    participants = await get_box_participants(id_box)
     
-    if not participants:
+    if not await is_box_owner(update.effective_user.id, id_box):
+        await update.message.reply_text("У вас нет прав на просмотр участников этой коробки")
+        return
+    
+    page = await build_participants_page(id_box)
+    
+    if not page:
         await update.message.reply_text("В коробке пока нет участников.")
         return
     
-    message = "Список участников:\n"
-    for user_id, username in participants:
-        message += f"- {username}\n"
+    text, reply_markup = page
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def handle_participants_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание списка участников: сообщение редактируется на месте"""
+    query = update.callback_query
+    _, id_box, direction, row_id = query.data.split(':')
+    id_box = int(id_box)
+    
+    # Кнопки могли переслать: список видит только организатор коробки
+    if not await is_box_owner(query.from_user.id, id_box):
+        await query.answer("У вас нет прав на просмотр участников этой коробки", show_alert=True)
+        return
+    await query.answer()
+    
+    if direction == 'next':
+        page = await build_participants_page(id_box, after_id=int(row_id))
+    else:
+        page = await build_participants_page(id_box, before_id=int(row_id))
+    if not page:
+        # Участники с этой страницы успели выйти - показываем список сначала
+        page = await build_participants_page(id_box)
     
-    await update.message.reply_text(message)
+    text, reply_markup = page if page else ("В коробке пока нет участников.", None)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest:
+        # Повторное нажатие на ту же кнопку: сообщение не изменилось
+        pass
 
 async def download_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Скачать список участников в CSV"""
+    await send_participants_export(update, context, 'csv')
+
+async def download_participants_xlsx(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Скачать список участников в XLSX"""
+    if not XLSX_AVAILABLE:
+        await update.message.reply_text("Выгрузка в XLSX сейчас недоступна, отправляем CSV.")
+        fmt = 'csv'
+    else:
+        fmt = 'xlsx'
+    await send_participants_export(update, context, fmt)
+
+async def send_participants_export(update: Update, context: ContextTypes.DEFAULT_TYPE, fmt: str):
+    """Формирование и отправка файла с участниками, парами и пожеланиями"""
+    user_id = update.effective_user.id
     id_box = context.user_data.get('current_box_id')
-    participants = await get_box_participants(id_box)
     
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Username'])
-    writer.writerows(participants)
+    if not await is_box_owner(user_id, id_box):
+        await update.message.reply_text("У вас нет прав на выгрузку списка участников")
+        return
     
-    output.seek(0)
+    file = await export_participants(id_box, fmt)
+    try:
+        # Готовый файл читаем в отдельном потоке: на больших коробках он уже лежит на диске
+        data = await asyncio.to_thread(file.read)
+    finally:
+        file.close()
     await update.message.reply_document(
-        document=io.BytesIO(output.getvalue().encode()),
-        filename='participants.csv'
+        document=data,
+        filename=f'participants_{id_box}.{fmt}'
+    )
+
+def format_draw_message(pair: dict) -> str:
+    """Текст уведомления Санте о его получателе"""
+    return (
+        f"🎅 Жеребьевка проведена!\n\n"
+        f"Вы стали Тайным Сантой для {pair['recipient_username']}!\n\n"
+        f"Имя: {pair['recipient_name']}\n"
+        f"Адрес: {pair['recipient_address']}\n"
+        f"Пожелание: {pair['recipient_wish']}"
     )
 
 async def start_santa_draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -116,7 +223,18 @@ async def start_santa_draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("У вас нет прав на проведение жеребьевки")
         return
     
-    pairs = await create_santa_pairs(id_box)
+    try:
+        # Уведомления ставятся в outbox в одной транзакции с парами: после сбоя
+        # не останется жеребьевки без рассылки
+        pairs = await create_santa_pairs(
+            id_box,
+            format_message=format_draw_message,
+            title="Рассылка результатов жеребьевки",
+            report_chat_id=update.effective_chat.id
+        )
+    except DrawUnsatisfiable as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
     
     if not pairs:
         await update.message.reply_text(
@@ -124,19 +242,10 @@ async def start_santa_draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Отправка сообщений участникам
-    for santa_id, recipient_id in pairs:
-        recipient = await get_user_info(recipient_id)
-        try:
-            await context.bot.send_message(
-                chat_id=santa_id,
-                text=f"🎅 Жеребьевка проведена!\n\n"
-                     f"Вы стали Тайным Сантой для {recipient['username']}!"
-            )
-        except Exception as e:
-            print(f"Ошибка отправки сообщения пользователю {santa_id}: {e}")
+    # Уведомления отправляются в фоне, не задерживая обработку обновления
+    outbox_worker.wake()
     
-    await update.message.reply_text("✨ Жеребьевка успешно проведена! Все участники получили уведомления.")
+    await update.message.reply_text("✨ Жеребьевка успешно проведена! Участники получают уведомления.")
 
 async def notify_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отправить уведомление всем участникам"""
@@ -156,16 +265,14 @@ async def send_notification(update: Update, context: ContextTypes.DEFAULT_TYPE):
     id_box = context.user_data.get('current_box_id')
     participants = await get_box_participants(id_box)
     
-    for user_id, _ in participants:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=message_text
-            )
-        except Exception as e:
-            print(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+    await queue_broadcast(
+        [(user_id, message_text) for user_id, _ in participants],
+        report_chat_id=update.effective_chat.id,
+        title="Рассылка уведомления",
+        id_box=id_box
+    )
     
-    await update.message.reply_text("Уведомления отправлены всем участникам!")
+    await update.message.reply_text("Рассылка уведомления запущена, прогресс будет в отдельном сообщении.")
     return ConversationHandler.END 
 
 async def delete_box_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -181,7 +288,9 @@ async def delete_box_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("У вас нет прав на удаление этой коробки")
         return await return_to_main_menu(update, context)
     
-    await delete_box(id_box)
+    box_photo = await delete_box(id_box)
+    # Файл фото удаляется, только если одинаковое фото не использует другая коробка
+    await release_photo(box_photo)
     context.user_data.pop('current_box_id', None)  # Удаляем ID коробки из контекста
     
     await update.message.reply_text(
@@ -1,7 +1,7 @@
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler
 from database import add_participant, get_box_info, is_participant, update_participant_info, remove_participant, get_participant_info
-import os
+from handler.box_handler import send_box_photo
 # Состояния для присоединения к коробке
 (ENTER_BOX_ID, ENTER_NAME, ENTER_ADDRESS, ENTER_WISH, MENU) = range(5)
 
@@ -163,35 +163,20 @@ async def process_wish(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         # Получаем информацию о коробке
         box_info = await get_box_info(box_id)
         
-        if box_info['box_photo'] and os.path.exists(box_info['box_photo']):
-            with open(box_info['box_photo'], 'rb') as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=(
-                        "✅ <b>Вы успешно присоединились к коробке!</b>\n\n"
-                        f"<b>Название коробки:</b> {box_info['box_name']}\n"
-                        f"<b>ID коробки:</b> <code>{box_info['id_box']}</code>\n"
-                        f"<b>Описание:</b>\n<blockquote>{box_info['box_desc']}</blockquote>\n\n"
-                        "👤 <b>Ваши данные:</b>\n"
-                        f"<b>Имя:</b> {name}\n"
-                        f"<b>Адрес:</b> {address}\n"
-                        f"<b>Пожелание:</b>\n<blockquote>{wish}</blockquote>\n\n"
-                        "✏️ Для изменения данных, вернитесь в главное меню и перейдите в настройки"
-                    ),
-                    parse_mode='HTML',
-                    reply_markup=reply_markup
-                )
-        else:
+        text = (
+            "✅ <b>Вы успешно присоединились к коробке!</b>\n\n"
+            f"<b>Название коробки:</b> {box_info['box_name']}\n"
+            f"<b>ID коробки:</b> <code>{box_info['id_box']}</code>\n"
+            f"<b>Описание:</b>\n<blockquote>{box_info['box_desc']}</blockquote>\n\n"
+            "👤 <b>Ваши данные:</b>\n"
+            f"<b>Имя:</b> {name}\n"
+            f"<b>Адрес:</b> {address}\n"
+            f"<b>Пожелание:</b>\n<blockquote>{wish}</blockquote>\n\n"
+            "✏️ Для изменения данных, вернитесь в главное меню и перейдите в настройки"
+        )
+        if not await send_box_photo(update.message, box_info, text, parse_mode='HTML', reply_markup=reply_markup):
             await update.message.reply_text(
-                "✅ <b>Вы успешно присоединились к коробке!</b>\n\n"
-                f"<b>Название коробки:</b> {box_info['box_name']}\n"
-                f"<b>ID коробки:</b> <code>{box_info['id_box']}</code>\n"
-                f"<b>Описание:</b>\n<blockquote>{box_info['box_desc']}</blockquote>\n\n"
-                "👤 <b>Ваши данные:</b>\n"
-                f"<b>Имя:</b> {name}\n"
-                f"<b>Адрес:</b> {address}\n"
-                f"<b>Пожелание:</b>\n<blockquote>{wish}</blockquote>\n\n"
-                "✏️ Для изменения данных, вернитесь в главное меню и перейдите в настройки",
+                text,
                 parse_mode='HTML',
                 reply_markup=reply_markup
             )
@@ -331,34 +316,19 @@ async def show_box_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         box_info = await get_box_info(box_id)
         user_info = await get_participant_info(update.effective_user.id, box_id)
         
-        # Если есть фото, отправляем его
-        if box_info['box_photo'] and os.path.exists(box_info['box_photo']):
-            with open(box_info['box_photo'], 'rb') as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=(
-                        f"📦 Информация о коробке:\n"
-                        f"ID коробки: {box_info['id_box']}\n"
-                        f"Название: {box_info['box_name']}\n"
-                        f"Описание: {box_info['box_desc']}\n\n"
-                        f"👤 Ваши данные в коробке:\n"
-                        f"Имя: {user_info['user_name']}\n"
-                        f"Адрес: {user_info['user_adds']}\n"
-                        f"Пожелание: {user_info['user_wish']}"
-                    )
-                )
-        else:
-            # Если фото нет, отправляем только текст
-            await update.message.reply_text(
-                f"📦 Информация о коробке:\n"
-                f"ID коробки: {box_info['id_box']}\n"
-                f"Название: {box_info['box_name']}\n"
-                f"Описание: {box_info['box_desc']}\n\n"
-                f"👤 Ваши данные в коробке:\n"
-                f"Имя: {user_info['user_name']}\n"
-                f"Адрес: {user_info['user_adds']}\n"
-                f"Пожелание: {user_info['user_wish']}"
-            )
+        text = (
+            f"📦 Информация о коробке:\n"
+            f"ID коробки: {box_info['id_box']}\n"
+            f"Название: {box_info['box_name']}\n"
+            f"Описание: {box_info['box_desc']}\n\n"
+            f"👤 Ваши данные в коробке:\n"
+            f"Имя: {user_info['user_name']}\n"
+            f"Адрес: {user_info['user_adds']}\n"
+            f"Пожелание: {user_info['user_wish']}"
+        )
+        # Если есть фото, отправляем его, иначе только текст
+        if not await send_box_photo(update.message, box_info, text):
+            await update.message.reply_text(text)
         return MENU
         
     except Exception as e:
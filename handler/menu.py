@@ -0,0 +1,68 @@
+from telegram import Update
+from telegram.ext import BaseHandler, filters
+
+# Все кнопки меню бота: текст кнопки -> идентификатор.
+# Один словарь на всё приложение: проверка текста - поиск по хэшу вместо regex.
+MENU_BUTTONS = {
+    # Главное меню
+    'Создать коробку': 'create_box',
+    'Присоединиться к коробке': 'join_box',
+    'Настройки': 'settings',
+    'Вернуться в меню': 'main_menu',
+    # Меню организатора
+    'Управление коробкой': 'manage_box',
+    'Список участников': 'participants',
+    'Скачать список участников': 'download_participants',
+    'Скачать список участников (XLSX)': 'download_participants_xlsx',
+    'Провести жеребьевку': 'draw',
+    'Уведомить участников': 'notify',
+    'Удалить коробку': 'delete_box',
+    # Меню участника
+    'Изменить имя': 'edit_name',
+    'Изменить адрес': 'edit_address',
+    'Изменить пожелание': 'edit_wish',
+    'Информация о коробке': 'box_info',
+    'Отменить участие': 'cancel_participation',
+}
+
+
+class MenuButton(filters.MessageFilter):
+    """Фильтр нажатия кнопки меню: точное совпадение текста сообщения с текстом кнопки"""
+
+    __slots__ = ('button',)
+
+    def __init__(self, text: str):
+        # KeyError здесь означает опечатку: текст должен быть в MENU_BUTTONS
+        self.button = MENU_BUTTONS[text]
+        super().__init__(name=f"MenuButton({text!r})")
+
+    def filter(self, message) -> bool:
+        return MENU_BUTTONS.get(message.text) == self.button
+
+
+class MenuHandler(BaseHandler):
+    """Обработчик нескольких кнопок меню: текст кнопки -> callback.
+
+    Текст сообщения ищется в словаре один раз, и вызывается callback нажатой
+    кнопки. Отдельный MessageHandler на каждую кнопку Application и
+    ConversationHandler проверяли бы по очереди.
+    """
+
+    __slots__ = ('callbacks',)
+
+    def __init__(self, callbacks: dict, block: bool = True):
+        for text in callbacks:
+            # KeyError здесь означает опечатку: текст должен быть в MENU_BUTTONS
+            MENU_BUTTONS[text]
+        super().__init__(None, block=block)
+        self.callbacks = dict(callbacks)
+
+    def check_update(self, update: object):
+        # Результат проверки - callback кнопки, он же передаётся в handle_update
+        if isinstance(update, Update) and update.effective_message:
+            return self.callbacks.get(update.effective_message.text)
+        return None
+
+    async def handle_update(self, update, application, check_result, context):
+        self.collect_additional_context(context, update, application, check_result)
+        return await check_result(update, context)
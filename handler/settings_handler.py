@@ -1,5 +1,6 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
+from telegram.error import BadRequest
 from database import (
     get_box_info, 
     get_participant_info, 
@@ -47,55 +48,94 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, mes
         )
     return ConversationHandler.END
 
+# Сколько коробок показываем на одной странице списка
+BOX_PAGE_SIZE = 8
+# Префикс callback_data кнопок листания: boxlist:<список>:<next|prev>:<id_box>
+BOX_PAGE_PREFIX = 'boxlist'
+
+# Списки коробок в настройках: загрузка страницы, заголовок, значок и префикс callback кнопки коробки
+BOX_LISTS = {
+    'participating': (get_participating_boxes, "🎁 <b>Коробки, в которых вы участвуете:</b>", "👤", "participant_box_"),
+    'created': (get_created_boxes, "👑 <b>Коробки, которые вы создали:</b>", "⚙️", "manage_box_"),
+}
+
+async def build_box_page(user_id: int, kind: str, after_id: int = None, before_id: int = None):
+    """Текст и клавиатура одной страницы списка коробок. None, если на странице нет коробок"""
+    load_boxes, title, icon, callback_prefix = BOX_LISTS[kind]
+    # Одна лишняя запись показывает, есть ли страница дальше в направлении листания
+    boxes = await load_boxes(user_id, limit=BOX_PAGE_SIZE + 1, after_id=after_id, before_id=before_id)
+    if not boxes:
+        return None
+    
+    has_more = len(boxes) > BOX_PAGE_SIZE
+    if before_id is not None:
+        # Предыдущая страница: лишняя запись - самая новая коробка, она в начале списка
+        boxes = boxes[-BOX_PAGE_SIZE:]
+        has_prev, has_next = has_more, True
+    else:
+        boxes = boxes[:BOX_PAGE_SIZE]
+        has_prev, has_next = after_id is not None, has_more
+    
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{icon} {box['box_name']} (ID {box['id_box']})",
+            callback_data=f"{callback_prefix}{box['id_box']}"
+        )]
+        for box in boxes
+    ]
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Назад", callback_data=f"{BOX_PAGE_PREFIX}:{kind}:prev:{boxes[0]['id_box']}"
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            "Далее ➡️", callback_data=f"{BOX_PAGE_PREFIX}:{kind}:next:{boxes[-1]['id_box']}"
+        ))
+    if navigation:
+        keyboard.append(navigation)
+    return title, InlineKeyboardMarkup(keyboard)
+
+async def show_box_list(update: Update, user_id: int, kind: str) -> bool:
+    """Первая страница списка коробок одним сообщением. Возвращает False, если коробок нет"""
+    page = await build_box_page(user_id, kind)
+    if not page:
+        return False
+    text, reply_markup = page
+    await update.message.reply_text(text, parse_mode='HTML', reply_markup=reply_markup)
+    return True
+
 async def show_participating_boxes(update: Update, user_id: int):
     """Показывает коробки, в которых пользователь участвует"""
-    participant_boxes = await get_participating_boxes(user_id)  # Используем новую функцию
-    
-    if participant_boxes:
-        await update.message.reply_text(
-            "🎁 <b>Коробки, в которых вы участвуете:</b>",
-            parse_mode='HTML'
-        )
-        
-        for box in participant_boxes:
-            keyboard = [[InlineKeyboardButton(
-                "👤 Подробнее",
-                callback_data=f"participant_box_{box['id_box']}"
-            )]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"📦 <b>{box['box_name']}</b>\n"
-                f"🔢 ID: <code>{box['id_box']}</code>",
-                parse_mode='HTML',
-                reply_markup=reply_markup
-            )
-    return bool(participant_boxes)
+    return await show_box_list(update, user_id, 'participating')
 
 async def show_created_boxes(update: Update, user_id: int):
     """Показывает коробки, созданные пользователем"""
-    created_boxes = await get_created_boxes(user_id)
+    return await show_box_list(update, user_id, 'created')
+
+async def handle_box_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Листание списка коробок: сообщение со списком редактируется на месте"""
+    query = update.callback_query
+    await query.answer()
     
-    if created_boxes:
-        await update.message.reply_text(
-            "\n👑 <b>Коробки, которые вы создали:</b>",
-            parse_mode='HTML'
-        )
-        
-        for box in created_boxes:
-            keyboard = [[InlineKeyboardButton(
-                "⚙️ Управление",
-                callback_data=f"manage_box_{box['id_box']}"
-            )]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"📦 <b>{box['box_name']}</b>\n"
-                f"🔢 ID: <code>{box['id_box']}</code>",
-                parse_mode='HTML',
-                reply_markup=reply_markup
-            )
-    return bool(created_boxes)
+    _, kind, direction, id_box = query.data.split(':')
+    if direction == 'next':
+        page = await build_box_page(query.from_user.id, kind, after_id=int(id_box))
+    else:
+        page = await build_box_page(query.from_user.id, kind, before_id=int(id_box))
+    if not page:
+        # Коробки с этой страницы успели удалить - показываем список сначала
+        page = await build_box_page(query.from_user.id, kind)
+    
+    if page:
+        text, reply_markup = page
+    else:
+        text, reply_markup = "❌ <b>У вас больше нет коробок в этом списке</b>", None
+    try:
+        await query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
+    except BadRequest:
+        # Повторное нажатие на ту же кнопку: сообщение не изменилось
+        pass
 
 async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка нажатия кнопки Настройки"""
@@ -1,7 +1,6 @@
 from telegram import ForceReply, Update, ReplyKeyboardMarkup
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler
-from database import add_user, get_user_info
-from datetime import datetime
+from user_registry import user_registry
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Начало работы с ботом"""
@@ -23,16 +22,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
 
-    # Проверяем, существует ли пользователь в базе данных
-    existing_user = await get_user_info(user.id)
-    
-    # Добавляем пользователя только если его нет в базе
-    if not existing_user:
-        await add_user(
-            user_id=user.id,
-            username=user.username,
-            connection_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        )
+    # Запись в базу только для нового пользователя или при смене username
+    await user_registry.remember(user.id, user.username)
 
     keyboard = [
         ['Создать коробку'],
@@ -1,4 +1,13 @@
+import asyncio
 import logging
+from config.config import load_env_file, load_config
+
+# Модули проекта читают свои настройки из окружения при импорте, поэтому
+# config/.env загружается до их импорта и только при запуске скрипта:
+# import main не меняет окружение
+if __name__ == '__main__':
+    load_env_file()
+
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -8,8 +17,17 @@ from telegram.ext import (
     ConversationHandler,
     CallbackQueryHandler
 )
-from database import init_app
+from database import init_pool, close_pool, set_db_path
+from broadcast import outbox_worker
+from persistence import persistence
+from photo_store import photo_sweeper
+from metrics import metrics_server, instrument_handlers
+from user_registry import user_registry
+from webhook import run_webhook
+from update_processor import PerUserUpdateProcessor
 from handler.start_handler import start
+from handler.menu import MenuButton, MenuHandler
+from handler.admin_handler import batch_draw
 from handler.box_handler import (
     create_box,
     get_box_name,
@@ -25,10 +43,13 @@ from handler.box_management_handler import (
     return_to_main_menu,
     show_participants,
     download_participants,
+    download_participants_xlsx,
     start_santa_draw,
     notify_participants,
     send_notification,
     delete_box_handler,
+    handle_participants_page,
+    PARTICIPANTS_PAGE_PREFIX,
     WAITING_FOR_NOTIFICATION_TEXT,
     MANAGE_BOX
 )
@@ -42,7 +63,9 @@ from handler.join_box_handler import (
 )
 from handler.settings_handler import (
     show_settings,
-    handle_box_callback
+    handle_box_callback,
+    handle_box_page,
+    BOX_PAGE_PREFIX
 )
 
 # Настройка логирования
@@ -51,19 +74,40 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-def main():
-    # Инициализация базы данных
-    init_app()
-    from config.config import BOT_TOKEN
-    # Создание приложения
-    application = Application.builder().token(BOT_TOKEN).build()
-    
+# Бот обрабатывает только сообщения и нажатия inline-кнопок, остальные обновления не запрашиваем
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+async def post_init(application: Application):
+    """Открываем пул соединений с базой данных до приёма обновлений"""
+    await init_pool()
+    # Продолжаем рассылки, прерванные перезапуском
+    outbox_worker.start(application.bot)
+    persistence.start(application)
+    # Файлы фото от незавершённого создания коробок и старых версий бота
+    photo_sweeper.start()
+    # Известные пользователи загружаются в фоне, /start работает и до окончания загрузки
+    user_registry.start()
+    await metrics_server.start(application)
+
+async def post_shutdown(application: Application):
+    """Закрываем соединения с базой данных при остановке бота"""
+    await metrics_server.stop()
+    await user_registry.stop()
+    await photo_sweeper.stop()
+    await persistence.stop()
+    await outbox_worker.stop()
+    await close_pool()
+
+def register_handlers(application: Application):
+    """Регистрация всех обработчиков бота"""
     # Обработчик команды /start
     application.add_handler(CommandHandler("start", start), group=0)
+    # Команды администратора
+    application.add_handler(CommandHandler("batch_draw", batch_draw))
     
     # Обработчик создания коробки
     box_creation_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^Создать коробку$'), create_box)],
+        entry_points=[MessageHandler(MenuButton('Создать коробку'), create_box)],
         states={
             NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_box_name)],
             PHOTO: [
@@ -72,69 +116,74 @@ def main():
             ],
             DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_description)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name="box_creation",
+        persistent=True
     )
     
     # Обработчик только для присоединения к коробке
 
     join_box_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^Присоединиться к коробке$'), join_box)],
+        entry_points=[MessageHandler(MenuButton('Присоединиться к коробке'), join_box)],
         states={
             ENTER_BOX_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_box_id)],
             ENTER_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_name)],
             ENTER_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_address)],
             ENTER_WISH: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_wish)],
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name="join_box",
+        persistent=True
     )
 
     # Обработчик управления коробкой
     box_management_handler = ConversationHandler(
         entry_points=[
-            MessageHandler(filters.Regex('^Управление коробкой$'), show_box_menu),
+            MessageHandler(MenuButton('Управление коробкой'), show_box_menu),
             CallbackQueryHandler(handle_box_callback, pattern=r'^manage_box_\d+$')
         ],
         states={
-            MANAGE_BOX: [
-                MessageHandler(filters.Regex('^Список участников$'), show_participants),
-                MessageHandler(filters.Regex('^Скачать список участников$'), download_participants),
-                MessageHandler(filters.Regex('^Провести жеребьевку$'), start_santa_draw),
-                MessageHandler(filters.Regex('^Уведомить участников$'), notify_participants),
-                MessageHandler(filters.Regex('^Удалить коробку$'), delete_box_handler),
-            ],
+            MANAGE_BOX: [MenuHandler({
+                'Список участников': show_participants,
+                'Скачать список участников': download_participants,
+                'Скачать список участников (XLSX)': download_participants_xlsx,
+                'Провести жеребьевку': start_santa_draw,
+                'Уведомить участников': notify_participants,
+                'Удалить коробку': delete_box_handler,
+            })],
             WAITING_FOR_NOTIFICATION_TEXT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, send_notification)
             ],
         },
         fallbacks=[
-            MessageHandler(filters.Regex('^Вернуться в меню$'), return_to_main_menu),
+            MessageHandler(MenuButton('Вернуться в меню'), return_to_main_menu),
             CommandHandler('cancel', cancel)
         ],
         name="box_management",
-        persistent=False
+        persistent=True
     )
 
     # Обработчик для меню участника после нажатия кнопки "Подробнее"
     participant_menu_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(handle_box_callback, pattern=r'^participant_box_\d+$')],
         states={
-            MENU: [
-                MessageHandler(filters.Regex('^Изменить имя$'), edit_name),
-                MessageHandler(filters.Regex('^Изменить адрес$'), edit_address),
-                MessageHandler(filters.Regex('^Изменить пожелание$'), edit_wish),
-                MessageHandler(filters.Regex('^Информация о коробке$'), show_box_info),
-                MessageHandler(filters.Regex('^Отменить участие$'), cancel_participation),
-            ],
+            MENU: [MenuHandler({
+                'Изменить имя': edit_name,
+                'Изменить адрес': edit_address,
+                'Изменить пожелание': edit_wish,
+                'Информация о коробке': show_box_info,
+                'Отменить участие': cancel_participation,
+            })],
             EDIT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_edit_name)],
             EDIT_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_edit_address)],
             EDIT_WISH: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_edit_wish)],
         },
         fallbacks=[
-            MessageHandler(filters.Regex('^Вернуться в меню$'), return_to_main_menu),
+            MessageHandler(MenuButton('Вернуться в меню'), return_to_main_menu),
             CommandHandler('cancel', cancel)
         ],
         name="participant_menu",
-        persistent=False
+        persistent=True
     )
 
     # Добавляем обработчики в правильном порядке и без групп
@@ -144,11 +193,46 @@ def main():
     application.add_handler(participant_menu_handler)
     
     # Обработчики кнопок главного меню
-    application.add_handler(MessageHandler(filters.Regex('^Настройки$'), show_settings))
-    application.add_handler(MessageHandler(filters.Regex('^Вернуться в меню$'), return_to_main_menu))
+    application.add_handler(MenuHandler({
+        'Настройки': show_settings,
+        'Вернуться в меню': return_to_main_menu,
+    }))
+    application.add_handler(CallbackQueryHandler(handle_box_page, pattern=rf'^{BOX_PAGE_PREFIX}:'))
+    application.add_handler(CallbackQueryHandler(handle_participants_page, pattern=rf'^{PARTICIPANTS_PAGE_PREFIX}:'))
+
+    # Время выполнения, ошибки и число выполняющихся вызовов каждого обработчика (metrics.py)
+    instrument_handlers(application)
+
+def main(argv=None):
+    # Настройки из аргументов и окружения. База открывается и мигрирует в post_init
+    config = load_config(argv)
+    set_db_path(config['db_path'])
+    # Создание приложения
+    builder = (
+        Application.builder()
+        .token(config['token'])
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # Незавершённые диалоги и user_data переживают перезапуск
+        .persistence(persistence)
+        # Разные пользователи обрабатываются параллельно, обновления одного - по порядку
+        .concurrent_updates(PerUserUpdateProcessor())
+    )
+    if config['api_url']:
+        # Локальный Bot API сервер или тестовый стенд
+        builder.base_url(f"{config['api_url']}/bot").base_file_url(f"{config['api_url']}/file/bot")
+    if config['mode'] == 'webhook':
+        # Обновления кладёт в очередь собственный HTTP-сервер, Updater не нужен
+        builder.updater(None)
+    application = builder.build()
+    
+    register_handlers(application)
 
     # Запуск бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config['mode'] == 'webhook':
+        asyncio.run(run_webhook(application, allowed_updates=ALLOWED_UPDATES))
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
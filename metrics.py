@@ -0,0 +1,231 @@
+import functools
+import inspect
+import os
+from bisect import bisect_left
+from time import perf_counter
+from aiohttp import web
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+# Адрес и порт страницы с метриками в формате Prometheus. METRICS_PORT=0 отключает её
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 9108)
+METRICS_PATH = '/metrics'
+# Границы корзин гистограммы времени выполнения, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Семейства метрик: префикс имени, метка и описание
+FAMILIES = {
+    'handler': ('santa_handler', 'handler', 'обработчиков обновлений'),
+    'db': ('santa_db_query', 'query', 'функций database.py'),
+}
+
+
+class Timer:
+    """Гистограмма времени выполнения, число ошибок и выполняющихся сейчас вызовов одной функции.
+
+    Запись - несколько сложений без блокировок: все вызовы идут в одном цикле событий.
+    """
+    __slots__ = ('buckets', 'sum', 'count', 'errors', 'in_flight')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+_timers = {kind: {} for kind in FAMILIES}
+# Дополнительные значения: (префикс имени, функция, возвращающая словарь счётчиков)
+_gauge_sources = []
+
+
+def get_timer(kind: str, name: str) -> Timer:
+    timers = _timers[kind]
+    timer = timers.get(name)
+    if timer is None:
+        timer = timers[name] = Timer()
+    return timer
+
+
+def add_gauges(prefix: str, source):
+    """Значения source() будут отдаваться как {prefix}_{ключ}"""
+    _gauge_sources.append((prefix, source))
+
+
+def reset():
+    """Сброс накопленных значений. Обёртки держат ссылки на Timer, поэтому обнуляются сами объекты."""
+    for timers in _timers.values():
+        for timer in timers.values():
+            timer.__init__()
+
+
+def instrument(kind: str, name: str, func):
+    """Обёртка асинхронной функции или асинхронного генератора, записывающая метрики вызовов.
+    Остальные функции возвращаются без изменений."""
+    if not (inspect.isasyncgenfunction(func) or inspect.iscoroutinefunction(func)):
+        return func
+    timer = get_timer(kind, name)
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            # Для генератора замеряется весь обход, включая время между выдачей элементов
+            timer.in_flight += 1
+            started = perf_counter()
+            try:
+                async for item in func(*args, **kwargs):
+                    yield item
+            except Exception:
+                timer.errors += 1
+                raise
+            finally:
+                timer.in_flight -= 1
+                timer.observe(perf_counter() - started)
+    else:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            timer.in_flight += 1
+            started = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except ApplicationHandlerStop:
+                # Штатная остановка обработки обновления, не ошибка
+                raise
+            except Exception:
+                timer.errors += 1
+                raise
+            finally:
+                timer.in_flight -= 1
+                timer.observe(perf_counter() - started)
+
+    wrapper.timer = timer
+    return wrapper
+
+
+def instrument_module(namespace: dict, kind: str):
+    """Замена всех асинхронных функций модуля (кроме приватных) обёртками с метриками.
+    Вызывается в конце модуля: instrument_module(globals(), 'db')."""
+    module = namespace['__name__']
+    for name, func in list(namespace.items()):
+        if name.startswith('_') or getattr(func, '__module__', None) != module or hasattr(func, 'timer'):
+            continue
+        namespace[name] = instrument(kind, name, func)
+
+
+def _iter_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _iter_handlers(state_handlers)
+            yield from _iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+def instrument_handlers(application):
+    """Обёртки с метриками для всех зарегистрированных обработчиков, включая вложенные в ConversationHandler.
+    Вызывается после регистрации обработчиков."""
+    for group in application.handlers.values():
+        for handler in _iter_handlers(group):
+            # MenuHandler (handler/menu.py) вызывает callback кнопки из словаря callbacks
+            callbacks = getattr(handler, 'callbacks', None)
+            if isinstance(callbacks, dict):
+                for text, callback in callbacks.items():
+                    callbacks[text] = _instrument_handler(callback)
+            else:
+                handler.callback = _instrument_handler(handler.callback)
+
+
+def _instrument_handler(callback):
+    if hasattr(callback, 'timer'):
+        return callback
+    return instrument('handler', getattr(callback, '__name__', repr(callback)), callback)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(gauges: dict = None) -> str:
+    """Текст метрик в формате Prometheus (text exposition format 0.0.4)"""
+    lines = []
+    for kind, (prefix, label, title) in FAMILIES.items():
+        timers = sorted(_timers[kind].items())
+        if not timers:
+            continue
+        lines.append(f"# HELP {prefix}_duration_seconds Время выполнения {title}")
+        lines.append(f"# TYPE {prefix}_duration_seconds histogram")
+        for name, timer in timers:
+            labels = f'{label}="{_escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, timer.buckets):
+                cumulative += count
+                lines.append(f'{prefix}_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_duration_seconds_bucket{{{labels},le="+Inf"}} {timer.count}')
+            lines.append(f'{prefix}_duration_seconds_sum{{{labels}}} {timer.sum}')
+            lines.append(f'{prefix}_duration_seconds_count{{{labels}}} {timer.count}')
+        lines.append(f"# HELP {prefix}_errors_total Число вызовов {title}, завершившихся исключением")
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        lines.extend(f'{prefix}_errors_total{{{label}="{_escape(name)}"}} {timer.errors}' for name, timer in timers)
+        lines.append(f"# HELP {prefix}_in_flight Число выполняющихся сейчас вызовов {title}")
+        lines.append(f"# TYPE {prefix}_in_flight gauge")
+        lines.extend(f'{prefix}_in_flight{{{label}="{_escape(name)}"}} {timer.in_flight}' for name, timer in timers)
+    for name, value in (gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP-сервер, отдающий метрики по METRICS_PATH.
+
+    Кроме метрик обработчиков и запросов отдаёт счётчики обработчика
+    обновлений приложения (PerUserUpdateProcessor.metrics), если они есть,
+    и значения, добавленные через add_gauges.
+    """
+
+    def __init__(self, listen: str = METRICS_LISTEN, port: int = METRICS_PORT):
+        self.application = None
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(METRICS_PATH, self.handle_metrics)
+        return app
+
+    async def start(self, application=None):
+        if not self.port:
+            return
+        self.application = application
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        print(f"Метрики доступны на http://{self.listen}:{self.port}{METRICS_PATH}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def gauges(self) -> dict:
+        sources = list(_gauge_sources)
+        processor = getattr(self.application, 'update_processor', None)
+        if hasattr(processor, 'metrics'):
+            sources.append(('santa_updates', processor.metrics))
+        return {f'{prefix}_{key}': value for prefix, source in sources for key, value in source().items()}
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=render(self.gauges()).encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+metrics_server = MetricsServer()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from database import (
+    evict_persistent_data,
+    load_persistent_conversations,
+    load_persistent_user_data,
+    save_persistent_data
+)
+
+# Как часто (в секундах) приложение передаёт изменённые user_data и состояния диалогов
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL') or 10)
+# Через сколько дней без активности данные пользователя и его незавершённые диалоги удаляются
+PERSISTENCE_TTL_DAYS = float(os.getenv('PERSISTENCE_TTL_DAYS') or 30)
+# Как часто (в секундах) ищем устаревшие данные
+PERSISTENCE_EVICT_INTERVAL = 3600.0
+# Сколько ждём после первого изменения, чтобы записать все изменения одной транзакцией
+FLUSH_DELAY = 1.0
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение user_data и состояний ConversationHandler в базе бота.
+
+    Изменения копятся в памяти и записываются одной транзакцией через
+    FLUSH_DELAY секунд после первого изменения, а также при остановке бота.
+    Данные и незавершённые диалоги пользователей, неактивных дольше
+    PERSISTENCE_TTL_DAYS, удаляются из базы и из памяти приложения (user_data
+    и состояния ConversationHandler). bot_data и chat_data бот не использует.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_INTERVAL, ttl_days: float = PERSISTENCE_TTL_DAYS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.ttl = timedelta(days=ttl_days)
+        self._pending_user_data = {}
+        self._pending_conversations = {}
+        self._flush_task = None
+        self._evict_task = None
+        # Записи идут по очереди, чтобы более старая порция не перезаписала более новую
+        self._write_lock = asyncio.Lock()
+
+    def _cutoff(self) -> str:
+        return (datetime.now() - self.ttl).strftime('%Y-%m-%d %H:%M:%S')
+
+    async def get_user_data(self):
+        rows = await load_persistent_user_data(self._cutoff())
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        rows = await load_persistent_conversations(name, self._cutoff())
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key, new_state):
+        # None - диалог завершён, запись удаляется
+        state = None if new_state is None else json.dumps(new_state)
+        self._pending_conversations[(name, json.dumps(list(key)))] = state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict):
+        try:
+            self._pending_user_data[user_id] = json.dumps(data, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            print(f"Не удалось сохранить user_data пользователя {user_id}: {e}")
+            return
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        self._pending_user_data[user_id] = None
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        # Данные в памяти приложения всегда актуальнее, чем в базе
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        self._flush_task = None
+        await self._write()
+
+    async def _write(self):
+        """Запись накопленных изменений одной транзакцией"""
+        async with self._write_lock:
+            if not self._pending_user_data and not self._pending_conversations:
+                return
+            user_data, self._pending_user_data = self._pending_user_data, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            try:
+                await save_persistent_data(
+                    list(user_data.items()),
+                    [(name, key, state) for (name, key), state in conversations.items()]
+                )
+            except Exception as e:
+                print(f"Ошибка сохранения состояния бота: {e}")
+                # Возвращаем изменения в очередь, не затирая более свежие
+                self._pending_user_data = {**user_data, **self._pending_user_data}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+
+    async def flush(self):
+        """Немедленная запись всех изменений. Вызывается приложением при остановке."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._write()
+
+    def start(self, application):
+        """Запуск периодического удаления устаревших данных"""
+        self._evict_task = asyncio.create_task(self._evict_loop(application))
+
+    async def stop(self):
+        """Остановка удаления устаревших данных"""
+        if self._evict_task is None:
+            return
+        self._evict_task.cancel()
+        try:
+            await self._evict_task
+        except asyncio.CancelledError:
+            pass
+        self._evict_task = None
+
+    async def _evict(self, application):
+        """Удаление устаревших данных из базы и из памяти приложения"""
+        # Под блокировкой записи: изменения не записываются, пока мы сверяемся с _pending_*
+        async with self._write_lock:
+            user_ids, conversations = await evict_persistent_data(self._cutoff())
+            # Данные в памяти тоже освобождаем, чтобы они не росли без ограничений.
+            # Изменённые после чтения из базы (ещё не записанные) не трогаем: пользователь активен
+            for user_id in user_ids:
+                if user_id in application.user_data and user_id not in self._pending_user_data:
+                    application.drop_user_data(user_id)
+            handlers = {
+                handler.name: handler
+                for group in application.handlers.values() for handler in group
+                if isinstance(handler, ConversationHandler) and handler.persistent
+            }
+            for name, key in conversations:
+                handler = handlers.get(name)
+                if handler is not None and (name, key) not in self._pending_conversations:
+                    # У ConversationHandler нет публичного способа завершить диалог
+                    handler._conversations.pop(tuple(json.loads(key)), None)
+        return user_ids, conversations
+
+    async def _evict_loop(self, application):
+        while True:
+            try:
+                user_ids, conversations = await self._evict(application)
+                if user_ids or conversations:
+                    print(f"Удалены данные неактивных пользователей: {len(user_ids)}, "
+                          f"незавершённых диалогов: {len(conversations)}")
+            except Exception as e:
+                print(f"Ошибка удаления устаревших данных: {e}")
+            await asyncio.sleep(PERSISTENCE_EVICT_INTERVAL)
+
+
+# Одно хранилище на процесс
+persistence = SQLitePersistence()
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import time
+from importlib.util import find_spec
+from database import count_photo_references, find_photo_copy, get_photo_paths
+
+# Уменьшение фото - необязательная возможность: без Pillow файл сохраняется как есть.
+# Pillow импортируется при первом сохранении фото, а не при запуске бота
+PILLOW_AVAILABLE = find_spec('PIL') is not None
+
+# Папка с локальными копиями фото коробок
+PHOTO_DIR = os.getenv("PHOTO_DIR", "photo_box")
+# Максимальная сторона сохраняемой копии в пикселях и качество JPEG
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE") or 1280)
+PHOTO_QUALITY = 85
+# Как часто (в секундах) удаляются файлы, на которые не ссылается ни одна коробка
+PHOTO_SWEEP_INTERVAL = 3600.0
+# Сколько часов не трогаем файл без ссылок: его могли сохранить для коробки,
+# которую пользователь ещё создаёт
+PHOTO_GRACE_HOURS = float(os.getenv("PHOTO_GRACE_HOURS") or 24)
+
+
+def photo_path(digest: str) -> str:
+    """Путь к файлу по хэшу содержимого. Подпапка по первым символам хэша,
+    чтобы в одной папке не скапливались тысячи файлов."""
+    return os.path.join(PHOTO_DIR, digest[:2], f"{digest}.jpg")
+
+
+def _shrink(data: bytes) -> bytes:
+    """Уменьшение фото до PHOTO_MAX_SIDE по большей стороне"""
+    if not PILLOW_AVAILABLE:
+        return data
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= PHOTO_MAX_SIDE and image.format == 'JPEG':
+                return data
+            image.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE))
+            output = io.BytesIO()
+            image.convert('RGB').save(output, 'JPEG', quality=PHOTO_QUALITY, optimize=True)
+            return output.getvalue()
+    except OSError as e:
+        print(f"Не удалось обработать фото, сохраняем как есть: {e}")
+        return data
+
+
+def _store(data: bytes) -> str:
+    """Сохранение фото под именем из хэша содержимого. Одинаковые фото хранятся один раз."""
+    path = photo_path(hashlib.sha256(data).hexdigest())
+    if _touch(path):
+        return path
+    content = _shrink(data)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Запись через временный файл: другой запрос не увидит недописанное фото
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _touch(path: str) -> bool:
+    """Обновление времени изменения файла, который снова нужен новой коробке: пока
+    не истёк PHOTO_GRACE_HOURS, его не удалят ни _sweep, ни release_photo.
+    False, если файла нет."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _read(path: str):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _remove_stale(path: str, grace: float):
+    """Удаление файла, если он не менялся дольше grace секунд"""
+    try:
+        if os.path.getmtime(path) < time.time() - grace:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _sweep(referenced: set, grace: float) -> int:
+    """Удаление файлов PHOTO_DIR, которых нет в referenced (абсолютные пути)
+    и которые не менялись дольше grace секунд. Возвращает число удалённых файлов."""
+    removed = 0
+    deadline = time.time() - grace
+    for directory, _, names in os.walk(PHOTO_DIR):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.abspath(path) in referenced:
+                continue
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+async def save_photo(data: bytes) -> str:
+    """Сохранение фото коробки. Хэширование, уменьшение и запись идут в отдельном потоке.
+    Возвращает путь к файлу."""
+    return await asyncio.to_thread(_store, data)
+
+
+async def find_photo(box_photo_unique_id: str):
+    """Уже сохранённая копия фото с тем же file_unique_id. None, если копии нет.
+    Время изменения найденного файла обновляется, как при повторном сохранении."""
+    path = await find_photo_copy(box_photo_unique_id)
+    if path and await asyncio.to_thread(_touch, path):
+        return path
+    return None
+
+
+async def read_photo(path: str):
+    """Чтение фото без блокировки цикла событий. None, если файла нет."""
+    if not path:
+        return None
+    return await asyncio.to_thread(_read, path)
+
+
+async def release_photo(path: str):
+    """Удаление файла фото, если на него больше не ссылается ни одна коробка.
+    Файл моложе PHOTO_GRACE_HOURS остаётся: его могли только что выбрать для
+    создаваемой коробки. Такой файл позже удалит photo_sweeper."""
+    if not path:
+        return
+    if await count_photo_references(path) == 0:
+        await asyncio.to_thread(_remove_stale, path, PHOTO_GRACE_HOURS * 3600)
+
+
+class PhotoSweeper:
+    """Периодическое удаление файлов фото без ссылок.
+
+    Такие файлы остаются, если пользователь прислал фото, но не закончил
+    создание коробки, а также от старых версий бота, которые называли файлы
+    по времени загрузки. Файлы моложе PHOTO_GRACE_HOURS не удаляются.
+    """
+
+    def __init__(self, interval: float = PHOTO_SWEEP_INTERVAL, grace_hours: float = PHOTO_GRACE_HOURS):
+        self.interval = interval
+        self.grace = grace_hours * 3600
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def sweep(self) -> int:
+        """Один проход удаления. Возвращает число удалённых файлов."""
+        referenced = {os.path.abspath(path) for path in await get_photo_paths()}
+        return await asyncio.to_thread(_sweep, referenced, self.grace)
+
+    async def _loop(self):
+        while True:
+            try:
+                removed = await self.sweep()
+                if removed:
+                    print(f"Удалены файлы фото без коробок: {removed}")
+            except Exception as e:
+                print(f"Ошибка удаления файлов фото: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Одна очистка на процесс
+photo_sweeper = PhotoSweeper()
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+from time import perf_counter
+from aiosqlite.context import contextmanager
+
+# Запросы дольше порога (в миллисекундах) попадают в лог вместе с планом выполнения.
+# SLOW_QUERY_MS=0 отключает замер
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS') or 100)
+
+
+def params_shape(parameters) -> str:
+    """Типы параметров запроса без самих значений: в параметрах бывают адреса и пожелания"""
+    if parameters is None:
+        return '()'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+    return type(parameters).__name__
+
+
+def many_params_shape(parameters) -> str:
+    if isinstance(parameters, (list, tuple)):
+        first = params_shape(parameters[0]) if parameters else '()'
+        return f'{len(parameters)} x {first}'
+    return f'{type(parameters).__name__} (итератор)'
+
+
+async def explain(db, sql: str, parameters=None) -> list:
+    """Строки EXPLAIN QUERY PLAN с отступами по вложенности"""
+    rows = await db.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}", parameters)
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+
+class TracedConnection:
+    """Соединение из пула, замеряющее время каждого запроса.
+
+    Для execute замеряется выполнение до первой строки результата (так работает
+    sqlite3), для execute_fetchall - вместе с чтением всех строк. Остальные
+    атрибуты берутся у исходного соединения.
+    """
+    __slots__ = ('_db',)
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    @contextmanager
+    async def execute(self, sql: str, parameters=None):
+        started = perf_counter()
+        cursor = await self._db.execute(sql, parameters)
+        await self._check(perf_counter() - started, sql, parameters)
+        return cursor
+
+    @contextmanager
+    async def executemany(self, sql: str, parameters):
+        started = perf_counter()
+        shape = many_params_shape(parameters)
+        cursor = await self._db.executemany(sql, parameters)
+        await self._check(perf_counter() - started, sql, None, shape)
+        return cursor
+
+    @contextmanager
+    async def execute_fetchall(self, sql: str, parameters=None):
+        started = perf_counter()
+        rows = await self._db.execute_fetchall(sql, parameters)
+        await self._check(perf_counter() - started, sql, parameters)
+        return rows
+
+    async def _check(self, elapsed: float, sql: str, parameters, shape: str = None):
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms < SLOW_QUERY_MS:
+            return
+        query = ' '.join(sql.split())
+        lines = [
+            f"Медленный запрос: {elapsed_ms:.1f} мс (порог {SLOW_QUERY_MS:g} мс)",
+            f"  SQL: {query}",
+            f"  Параметры: {shape or params_shape(parameters)}",
+        ]
+        if shape is None:
+            # План строится на том же соединении и с теми же параметрами
+            try:
+                plan = await explain(self._db, sql, parameters)
+                lines.append("  План:")
+                lines.extend(f"    {line}" for line in plan)
+            except sqlite3.Error as e:
+                lines.append(f"  План получить не удалось: {e}")
+        print('\n'.join(lines))
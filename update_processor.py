@@ -0,0 +1,138 @@
+import asyncio
+import os
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько обновлений разных пользователей обрабатывается одновременно
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES') or 16)
+# Сколько принятых webhook-сервером обновлений может быть не обработано, прежде чем
+# он начнёт отвечать 503 и Telegram будет доставлять обновления повторно
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES') or 1024)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей.
+
+    Обновления одного пользователя выполняются строго по очереди, в порядке
+    поступления, поэтому состояние ConversationHandler остаётся корректным.
+    Обновление сначала дожидается своей очереди у пользователя и только потом
+    занимает один из CONCURRENT_UPDATES рабочих слотов, так что активный
+    пользователь не отнимает слоты у остальных.
+
+    Сам обработчик не сдерживает поступление обновлений: PTB забирает их из
+    update_queue сразу и на каждое создаёт задачу. Ограничение на принятые
+    обновления даёт только admit, который webhook-сервер вызывает до
+    update_queue.put.
+    """
+
+    def __init__(self, concurrent_updates: int = CONCURRENT_UPDATES, max_pending: int = MAX_PENDING_UPDATES):
+        # Семафор базового класса лишь ограничивает число задач, прошедших дальше
+        # process_update; остальные задачи уже созданы и ждут перед ним
+        super().__init__(max(max_pending, concurrent_updates))
+        self.concurrent_updates = concurrent_updates
+        self._slots = asyncio.Semaphore(concurrent_updates)
+        self.max_pending = max_pending
+        self._user_locks = {}
+        # id обновлений, для которых admit зарезервировал место, и событие освобождения места
+        self._admitted = set()
+        self._released = asyncio.Event()
+        self.accepted = 0
+        self.in_flight = 0
+        self.processed = 0
+        self.max_pending_seen = 0
+
+    @staticmethod
+    def _ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # Считаем обновление до семафора базового класса: ожидающие перед ним
+        # тоже взяты из update_queue и входят в глубину очереди
+        self.accepted += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.accepted - self.in_flight)
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.accepted -= 1
+            if id(update) in self._admitted:
+                self._admitted.discard(id(update))
+                released, self._released = self._released, asyncio.Event()
+                released.set()
+
+    async def do_process_update(self, update, coroutine):
+        key = self._ordering_key(update)
+
+        if key is None:
+            lock = None
+        else:
+            entry = self._user_locks.get(key)
+            if entry is None:
+                entry = self._user_locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            lock = entry[0]
+
+        try:
+            if lock is not None:
+                await lock.acquire()
+            try:
+                async with self._slots:
+                    self.in_flight += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+            finally:
+                if lock is not None:
+                    lock.release()
+        finally:
+            if key is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._user_locks[key]
+
+    async def admit(self, update, timeout: float) -> bool:
+        """Резервирование места для обновления перед update_queue.put.
+
+        Место занято, пока обновление не обработано. Если занято max_pending мест,
+        ждёт освобождения не дольше timeout секунд и возвращает False, если не
+        дождалось. Ограничивать размер update_queue бесполезно: PTB сразу забирает
+        из неё каждое обновление и создаёт на него задачу.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(self._admitted) >= self.max_pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._released.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        # Между проверкой и резервированием нет await: место не займёт другой запрос
+        self._admitted.add(id(update))
+        return True
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def metrics(self) -> dict:
+        """Глубина очереди и загрузка обработчика. pending - обновления, взятые из
+        update_queue и ждущие своей очереди у пользователя или рабочего слота"""
+        return {
+            'pending': self.accepted - self.in_flight,
+            'admitted': len(self._admitted),
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'active_users': len(self._user_locks),
+            'max_pending_seen': self.max_pending_seen,
+            'concurrent_updates': self.concurrent_updates
+        }
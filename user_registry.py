@@ -0,0 +1,137 @@
+import asyncio
+import os
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from database import add_user, iter_known_users
+from metrics import add_gauges
+
+# Сколько новых и переименованных пользователей копится в словаре, прежде чем они
+# переносятся в отсортированные массивы
+REGISTRY_MERGE_SIZE = int(os.getenv('REGISTRY_MERGE_SIZE') or 50000)
+
+
+def username_hash(username: str) -> int:
+    """32-битный отпечаток username. Сами строки для миллиона пользователей заняли бы
+    в памяти в десяток раз больше; совпадение отпечатков при смене username почти невозможно."""
+    return zlib.crc32(username.encode('utf-8')) if username else 0
+
+
+def merge_sorted(ids: array, hashes: array, updates: dict):
+    """Новые массивы из отсортированных ids/hashes и словаря user_id -> отпечаток.
+    Значения из словаря заменяют старые. Участки между обновлениями копируются срезами."""
+    merged_ids, merged_hashes = array('q'), array('I')
+    start = 0
+    for user_id, value in sorted(updates.items()):
+        position = bisect_left(ids, user_id, start)
+        merged_ids.extend(ids[start:position])
+        merged_hashes.extend(hashes[start:position])
+        merged_ids.append(user_id)
+        merged_hashes.append(value)
+        start = position + 1 if position < len(ids) and ids[position] == user_id else position
+    merged_ids.extend(ids[start:])
+    merged_hashes.extend(hashes[start:])
+    return merged_ids, merged_hashes
+
+
+class UserRegistry:
+    """Известные боту пользователи и отпечатки их username.
+
+    Основная часть хранится в двух отсортированных массивах (user_id и отпечаток,
+    12 байт на пользователя), новые и переименованные пользователи - в словаре,
+    который при заполнении переносится в массивы в отдельном потоке. Массивы
+    заполняются из базы при запуске в фоне; пока они не загружены, пользователь
+    считается неизвестным и просто записывается в базу ещё раз.
+    """
+
+    def __init__(self, merge_size: int = REGISTRY_MERGE_SIZE):
+        self.merge_size = merge_size
+        self.hits = 0
+        self.misses = 0
+        self.warmed = False
+        self._ids = array('q')
+        self._hashes = array('I')
+        self._recent = {}
+        self._warm_task = None
+        self._merge_task = None
+
+    def start(self):
+        """Загрузка известных пользователей из базы в фоне"""
+        if self._warm_task is None:
+            self._warm_task = asyncio.create_task(self._warm())
+
+    async def stop(self):
+        for task in (self._warm_task, self._merge_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._warm_task = None
+        self._merge_task = None
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._recent)
+
+    def _known_hash(self, user_id: int):
+        value = self._recent.get(user_id)
+        if value is not None:
+            return value
+        ids = self._ids
+        position = bisect_left(ids, user_id)
+        if position < len(ids) and ids[position] == user_id:
+            return self._hashes[position]
+        return None
+
+    async def remember(self, user_id: int, username: str) -> bool:
+        """Сохранение пользователя, нажавшего /start. В базу пишет только нового
+        пользователя или сменившего username. Возвращает True, если была запись."""
+        value = username_hash(username)
+        if self._known_hash(user_id) == value:
+            self.hits += 1
+            return False
+        self.misses += 1
+        await add_user(user_id, username, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self._recent[user_id] = value
+        self._maybe_merge()
+        return True
+
+    def _maybe_merge(self):
+        # До загрузки массивов переносить некуда: загрузка заменит их целиком
+        if self.warmed and self._merge_task is None and len(self._recent) >= self.merge_size:
+            self._merge_task = asyncio.create_task(self._merge_recent())
+
+    def metrics(self) -> dict:
+        return {'known': len(self), 'hits': self.hits, 'misses': self.misses, 'warmed': int(self.warmed)}
+
+    async def _warm(self):
+        ids, hashes = array('q'), array('I')
+        try:
+            async for rows in iter_known_users():
+                ids.extend(row[0] for row in rows)
+                hashes.extend(username_hash(row[1]) for row in rows)
+        except Exception as e:
+            print(f"Не удалось загрузить список пользователей: {e}")
+            return
+        self._ids, self._hashes = ids, hashes
+        self.warmed = True
+        print(f"Известных пользователей загружено: {len(ids)}")
+        self._maybe_merge()
+
+    async def _merge_recent(self):
+        try:
+            # Снимок словаря: пока массивы собираются в потоке, в словарь добавляются новые записи
+            updates = dict(self._recent)
+            ids, hashes = await asyncio.to_thread(merge_sorted, self._ids, self._hashes, updates)
+            self._ids, self._hashes = ids, hashes
+            for user_id, value in updates.items():
+                if self._recent.get(user_id) == value:
+                    del self._recent[user_id]
+        finally:
+            self._merge_task = None
+
+
+user_registry = UserRegistry()
+add_gauges('santa_user_registry', user_registry.metrics)
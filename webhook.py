@@ -0,0 +1,128 @@
+import asyncio
+import os
+import signal
+from aiohttp import web
+from telegram import Update
+
+# Адрес и порт, на которых бот принимает обновления
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or 8443)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Публичный адрес (без пути), который сообщается Telegram через setWebhook.
+# Если не задан, webhook считается уже настроенным (например, за обратным прокси).
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Сколько одновременных соединений Telegram может открыть к боту (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS') or 40)
+# Сколько ждём освобождения места (MAX_PENDING_UPDATES), прежде чем попросить Telegram повторить доставку
+ADMIT_TIMEOUT = 5.0
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления от Telegram и кладущий их в update_queue приложения.
+
+    Число принятых, но ещё не обработанных обновлений ограничено
+    (PerUserUpdateProcessor.admit, MAX_PENDING_UPDATES). Когда мест нет, запрос
+    ждёт ADMIT_TIMEOUT секунд, а затем получает 503, и Telegram доставит
+    обновление повторно.
+    """
+
+    def __init__(self, application, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.draining = False
+        self._runner = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        print(f"Webhook-сервер слушает {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Прекращение приёма обновлений. Уже принятые остаются в очереди и будут обработаны."""
+        self.draining = True
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            return web.Response(status=403)
+        if self.draining:
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.application.bot)
+        processor = self.application.update_processor
+        if hasattr(processor, 'admit') and not await processor.admit(update, ADMIT_TIMEOUT):
+            return web.Response(status=503)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        health = {
+            'queue_size': self.application.update_queue.qsize(),
+            'draining': self.draining
+        }
+        processor = self.application.update_processor
+        if hasattr(processor, 'metrics'):
+            health['processor'] = processor.metrics()
+        return web.json_response(health)
+
+
+async def run_webhook(application, allowed_updates=None):
+    """Запуск бота в режиме webhook.
+
+    Повторяет жизненный цикл run_polling (post_init, post_stop, post_shutdown).
+    По SIGINT/SIGTERM сервер перестаёт принимать обновления, приложение
+    дообрабатывает очередь и только затем останавливается.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка через KeyboardInterrupt
+            pass
+
+    server = WebhookServer(application)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + server.path,
+                secret_token=server.secret,
+                allowed_updates=allowed_updates,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            print("Остановка: обрабатываем оставшиеся обновления...")
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)